@@ -0,0 +1,112 @@
+"""
+Provider Response Cache
+TTL caches for routing, weather and traffic lookups
+Keys are built from quantized coordinates so repeated GPS ticks hit the cache
+"""
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Set API_CACHE_DISABLED=1 to bypass all provider caches (debugging, benchmarks)
+CACHE_DISABLED = os.getenv('API_CACHE_DISABLED', '').lower() in ('1', 'true', 'yes')
+
+# Time-to-live per provider (seconds)
+ROUTE_TTL_S = 300
+# Failed routes (NoRoute, provider errors) are remembered briefly so hot bad inputs don't hammer the router
+ROUTE_FAILURE_TTL_S = 60
+TRAFFIC_TTL_S = 300
+WEATHER_TTL_S = 600
+
+# 4 decimal places ~ 11 m: GPS jitter between ticks collapses onto one key
+COORD_PRECISION = 4
+
+# Traffic conditions don't change within ~110 m, so traffic keys are coarser
+TRAFFIC_COORD_PRECISION = 3
+
+
+def quantize(lat: float, lon: float, ndigits: int = COORD_PRECISION) -> Tuple[float, float]:
+    """Round a coordinate pair for use in a cache key"""
+    return (round(float(lat), ndigits), round(float(lon), ndigits))
+
+
+def waypoints_key(waypoints: List[Tuple[float, float]],
+                  ndigits: int = COORD_PRECISION) -> Tuple[Tuple[float, float], ...]:
+    """Hashable cache key for a list of (lat, lon) waypoints"""
+    return tuple(quantize(lat, lon, ndigits) for lat, lon in waypoints)
+
+
+class ProviderCache:
+    """Thread-safe, size-bounded TTL cache for provider responses"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None on miss/expiry"""
+        if CACHE_DISABLED:
+            return None
+        with self._lock:
+            return self._cache.get(key)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value under key"""
+        if CACHE_DISABLED:
+            return
+        with self._lock:
+            self._cache[key] = value
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        """Remove and return the value under key, or None if absent"""
+        with self._lock:
+            return self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop all cached entries"""
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one execution
+
+    The first caller for a key runs fn; callers arriving while it is in
+    flight block on its result (or exception) instead of repeating the
+    provider request.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Run fn for key, or wait for the call already in flight"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
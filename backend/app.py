@@ -2,42 +2,87 @@
 Live ETA & Delay Explanation System - Backend API v1.0
 FastAPI implementation of the MVP specification
 """
-from flask import Flask, request, jsonify
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# SOCKETIO_ASYNC_MODE=gevent serves each socket from a greenlet instead of an OS thread.
+# The stdlib must be patched before flask/requests/psycopg2 import socket and threading.
+SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'threading')
+if SOCKETIO_ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask.json.provider import DefaultJSONProvider
-from dotenv import load_dotenv
 import sys
-import os
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Set, Tuple
+from collections import defaultdict
+from dataclasses import dataclass
 from decimal import Decimal
-import math
+import orjson
+import hashlib
 import threading
 import time
+import queue
+import logging
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import RealDictCursor
+import numpy as np
 
-# Load environment variables
-load_dotenv()
+# Log records are queued and written by a listener thread, so request threads never block on stderr
+logger = logging.getLogger(__name__)
+_log_queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_listener.start()
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from data.db import Database
-from backend.valhalla_client import get_router, VehicleConstraints
-from backend.weather_api import get_weather_api
+from backend.valhalla_client import get_router, VehicleConstraints, DEFAULT_CONSTRAINTS, simplify_geometry
+from backend.api_cache import ProviderCache, quantize
+from backend.geo import haversine_km, haversine_vec, haversine_vec_rad, trig_terms
+from backend.weather_api import get_weather_api, WeatherImpact
 from backend.traffic_client import get_traffic_api
 
-# Custom JSON provider to handle Decimal types
-class DecimalJSONProvider(DefaultJSONProvider):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super().default(obj)
+# orjson handles datetime, dataclass and numpy values natively; Decimal needs a hook
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def _json_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default, option=ORJSON_OPTIONS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+def orjson_response(payload, status: int = 200) -> Response:
+    """JSON response encoded straight to bytes, skipping the provider's str round-trip"""
+    return Response(orjson.dumps(payload, default=_json_default, option=ORJSON_OPTIONS),
+                    status=status, mimetype='application/json')
 
 app = Flask(__name__)
-app.json = DecimalJSONProvider(app)
+app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 CORS(app, resources={r"/*": {"origins": "*"}})
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# Socket.IO packets are msgpack-encoded binary frames; the browser pairs this with socket.io-msgpack-parser
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SOCKETIO_ASYNC_MODE, serializer='msgpack')
 
 # Global state
 db = Database()
@@ -49,8 +94,45 @@ router = get_router(valhalla_url=valhalla_url, osrm_url=osrm_url)
 
 weather_api = get_weather_api()
 traffic_api = get_traffic_api()
+
+# Shared pool for fanning out blocking provider calls (weather/traffic/routing)
+io_pool = ThreadPoolExecutor(max_workers=int(os.getenv('IO_POOL_WORKERS', '16')),
+                             thread_name_prefix='eta-io')
+
 active_simulations = {}  # shipment_id -> simulation_thread
 
+# vehicle_id -> shipment_id of its active shipment. Warmed at startup, set by POST /v1/shipments,
+# and looked up in the DB on a miss so shipments created elsewhere are picked up while running
+ACTIVE_SHIPMENT_TTL_S = 300
+NO_ACTIVE_SHIPMENT_TTL_S = 30  # vehicles without one are re-checked this often
+active_shipment_cache = ProviderCache(maxsize=8192, ttl=ACTIVE_SHIPMENT_TTL_S)
+no_active_shipment_cache = ProviderCache(maxsize=8192, ttl=NO_ACTIVE_SHIPMENT_TTL_S)
+for _vehicle_id, _shipment_id in db.get_active_shipments_by_vehicle().items():
+    active_shipment_cache.set(_vehicle_id, _shipment_id)
+
+def active_shipment_for(vehicle_id: int) -> Optional[int]:
+    """Shipment id the vehicle is currently serving, or None (both outcomes are cached)"""
+    shipment_id = active_shipment_cache.get(vehicle_id)
+    if shipment_id is not None:
+        return shipment_id
+    if no_active_shipment_cache.get(vehicle_id):
+        return None
+    shipment_id = db.get_active_shipment_id(vehicle_id)
+    if shipment_id is None:
+        no_active_shipment_cache.set(vehicle_id, True)
+    else:
+        active_shipment_cache.set(vehicle_id, shipment_id)
+    return shipment_id
+
+# Reroute comparisons memoized per lane (previous stop -> next stop) and constraints: every fix
+# along a leg reuses one entry, and shipments on the same lane share it
+REROUTE_CACHE_TTL_S = 600
+REROUTE_ORIGIN_CELL_DIGITS = 2  # ~1 km cell; stands in for the lane start on a leg with no previous stop
+reroute_cache = ProviderCache(maxsize=8192, ttl=REROUTE_CACHE_TTL_S)
+# shipment_id -> last comparison key, for invalidation; entries expire with the comparison they point at
+reroute_key_by_shipment = ProviderCache(maxsize=8192, ttl=REROUTE_CACHE_TTL_S)
+REROUTE_PATH_TOLERANCE_M = 5.0  # suggested paths are simplified before they go to the browser
+
 # ==================== Delay Reason Codes ====================
 REASON_CODES = {
     'ON_TIME': 'on_time',
@@ -62,39 +144,50 @@ REASON_CODES = {
     'ROAD_INCIDENT': 'road_incident'
 }
 
+# Traffic segment styling: congestion level -> (speed_factor, color, level)
+CONGESTION_STYLES = {
+    'heavy': (0.3, '#DC2626', 'heavy'),        # Red
+    'moderate': (0.6, '#F59E0B', 'moderate'),  # Orange
+    'light': (0.8, '#FBBF24', 'light'),        # Yellow
+    'none': (1.0, '#10B981', 'none'),          # Green
+}
+
+@dataclass(frozen=True)
+class Coord:
+    """Segment endpoint; serialized by orjson as {"lat", "lon"}"""
+    __slots__ = ('lat', 'lon')
+    lat: float
+    lon: float
+
+@dataclass(frozen=True)
+class TrafficSegment:
+    """Styled route leg for the traffic endpoint; slotted to avoid a dict per segment"""
+    __slots__ = ('start', 'end', 'traffic_level', 'color', 'speed_factor',
+                 'current_speed_kph', 'freeflow_speed_kph')
+    start: Coord
+    end: Coord
+    traffic_level: str
+    color: str
+    speed_factor: float
+    current_speed_kph: int
+    freeflow_speed_kph: int
+
+# Only dwell at stops departed within this window can explain a current delay
+DWELL_LOOKBACK_MIN = 120
+
 # ==================== Helper Functions ====================
 
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculate distance between two points in kilometers using Haversine formula"""
-    R = 6371  # Earth's radius in kilometers
-    
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    return R * c
+    return haversine_km(lat1, lon1, lat2, lon2)
 
-def calculate_bearing(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate bearing between two points in degrees"""
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    dlon = math.radians(lon2 - lon1)
-    
-    y = math.sin(dlon) * math.cos(lat2_rad)
-    x = math.cos(lat1_rad) * math.sin(lat2_rad) - math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(dlon)
-    bearing = math.degrees(math.atan2(y, x))
-    
-    return (bearing + 360) % 360
-
-def interpolate_position(start: Dict, end: Dict, progress: float) -> Tuple[float, float]:
-    """Interpolate position between two points"""
-    lat = start['lat'] + (end['lat'] - start['lat']) * progress
-    lon = start['lon'] + (end['lon'] - start['lon']) * progress
-    return lat, lon
+def _ensure_datetime(row: Dict, key: str) -> Optional[datetime]:
+    """Return row[key] as a datetime, parsing an ISO string once and storing the result back"""
+    value = row.get(key)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        row[key] = value
+    return value
 
 def compute_eta_with_routing(current_pos: Dict, stops: List[Dict], 
                              vehicle_constraints: VehicleConstraints = None) -> List[Dict]:
@@ -105,12 +198,44 @@ def compute_eta_with_routing(current_pos: Dict, stops: List[Dict],
     where effective_speed = min(live_speed, historical_speed × weather_multiplier)
     """
     if vehicle_constraints is None:
-        vehicle_constraints = VehicleConstraints()
+        vehicle_constraints = DEFAULT_CONSTRAINTS
     
     etas = []
-    current_lat = current_pos['lat']
-    current_lon = current_pos['lon']
     cumulative_time = 0
+    now = datetime.utcnow()
+    
+    # Legs run current position -> each pending stop in order (completed stops are skipped)
+    pending = [s for s in stops if not s.get('completed')]
+    path = [(current_pos['lat'], current_pos['lon'])] + [(s['lat'], s['lon']) for s in pending]
+    leg_waypoints = [[path[i], path[i + 1]] for i in range(len(pending))]
+    
+    # Straight-line leg distances for the routing fallback, computed in one pass
+    fallback_km = haversine_vec([float(p[0]) for p in path], [float(p[1]) for p in path])
+    
+    # Weather and traffic lookups are independent network calls: issue them for
+    # all legs concurrently, then batch the routing calls that need their multipliers.
+    # Weather is sampled once per path point; adjacent legs share their common endpoint.
+    weather_future = io_pool.submit(weather_api.get_weather_batch, path)
+    traffic_future = io_pool.submit(traffic_api.get_traffic_on_routes, leg_waypoints)
+    point_weather = weather_future.result()
+    weather = [
+        weather_api.get_worst_weather_condition([w for w in point_weather[i:i + 2] if w])
+        for i in range(len(leg_waypoints))
+    ]
+    traffic = [traffic_api.calculate_traffic_multiplier(t) for t in traffic_future.result()]
+    
+    route_futures = [
+        io_pool.submit(
+            router.calculate_eta_with_traffic,
+            waypoints=wp,
+            constraints=vehicle_constraints,
+            traffic_multiplier=traffic_multiplier,
+            weather_multiplier=weather_multiplier
+        )
+        for wp, (weather_multiplier, _), (traffic_multiplier, _) in zip(leg_waypoints, weather, traffic)
+    ]
+    route_results = [f.result() for f in route_futures]
+    leg_idx = 0
     
     for stop in stops:
         if stop.get('completed'):
@@ -125,28 +250,12 @@ def compute_eta_with_routing(current_pos: Dict, stops: List[Dict],
             })
             continue
         
-        # Build waypoints for this leg
-        waypoints = [(current_lat, current_lon), (stop['lat'], stop['lon'])]
-        
-        # Get weather along route
-        weather_samples = weather_api.get_weather_along_route(waypoints, num_samples=3)
-        weather_multiplier, weather_reason = weather_api.get_worst_weather_condition(weather_samples)
-        
-        # Get traffic data along route
-        traffic_data = traffic_api.get_traffic_on_route(waypoints)
-        traffic_multiplier, traffic_reason = traffic_api.calculate_traffic_multiplier(traffic_data)
-        
-        # Calculate route with weather/traffic
-        route_result = router.calculate_eta_with_traffic(
-            waypoints=waypoints,
-            constraints=vehicle_constraints,
-            traffic_multiplier=traffic_multiplier,
-            weather_multiplier=weather_multiplier
-        )
+        weather_multiplier, weather_impact = weather[leg_idx]
+        route_result = route_results[leg_idx]
         
         if not route_result.get('success'):
             # Fallback to simple calculation
-            distance_km = calculate_distance(current_lat, current_lon, stop['lat'], stop['lon'])
+            distance_km = float(fallback_km[leg_idx])
             travel_time_min = (distance_km / 70.0) * 60
         else:
             distance_km = route_result['distance_km']
@@ -157,16 +266,14 @@ def compute_eta_with_routing(current_pos: Dict, stops: List[Dict],
         total_time_min = cumulative_time + travel_time_min + service_time_min
         
         # Calculate ETA
-        eta_ts = datetime.utcnow() + timedelta(minutes=total_time_min)
+        eta_ts = now + timedelta(minutes=total_time_min)
         
         # Determine if on time
-        planned_arr = stop.get('planned_arr_ts')
+        planned_arr = _ensure_datetime(stop, 'planned_arr_ts')
         on_time = True
         late_by_min = 0
         
         if planned_arr:
-            if isinstance(planned_arr, str):
-                planned_arr = datetime.fromisoformat(planned_arr.replace('Z', '+00:00'))
             if eta_ts > planned_arr:
                 on_time = False
                 late_by_min = int((eta_ts - planned_arr).total_seconds() / 60)
@@ -179,19 +286,17 @@ def compute_eta_with_routing(current_pos: Dict, stops: List[Dict],
             'reason_code': REASON_CODES['ON_TIME'],
             'confidence': 0.9,
             'distance_km': distance_km,
-            'weather_impact': weather_reason if weather_multiplier < 1.0 else None
+            'weather_impact': weather_impact if weather_multiplier < 1.0 else None
         })
         
-        # Update position for next stop
-        current_lat = stop['lat']
-        current_lon = stop['lon']
         cumulative_time = total_time_min
+        leg_idx += 1
     
     return etas
 
 def score_delay_reason(shipment: Dict, stops: List[Dict], 
                        current_pos: Dict, late_by_min: int,
-                       weather_impact: str = None,
+                       weather_impact: WeatherImpact = None,
                        traffic_data: Dict = None) -> Tuple[str, float, str]:
     """
     Score delay reasons using weather data, traffic data, and dwell tracking
@@ -220,32 +325,25 @@ def score_delay_reason(shipment: Dict, stops: List[Dict],
     elif traffic_data and traffic_data.get('congestion_level') in ['moderate', 'heavy']:
         scores[REASON_CODES['TRAFFIC_CONGESTION']] = 0.75
     
-    # Check weather impact
-    if weather_impact and "rain" in weather_impact.lower():
-        precip_match = __import__('re').search(r'(\d+\.?\d*)\s*mm/h', weather_impact)
-        if precip_match:
-            precip = float(precip_match.group(1))
-            if precip > 10:
-                scores[REASON_CODES['WEATHER_IMPACT']] = 0.85
-            elif precip > 5:
-                scores[REASON_CODES['WEATHER_IMPACT']] = 0.65
-    
-    if weather_impact and "wind" in weather_impact.lower():
-        wind_match = __import__('re').search(r'(\d+\.?\d*)\s*km/h', weather_impact)
-        if wind_match:
-            wind = float(wind_match.group(1))
-            if wind > 40:
-                scores[REASON_CODES['WEATHER_IMPACT']] = 0.80
+    # Check weather impact (spec: precipitation > 10 mm/h or wind > 40 km/h)
+    if weather_impact:
+        if weather_impact.precip_mm_h > 10:
+            scores[REASON_CODES['WEATHER_IMPACT']] = 0.85
+        elif weather_impact.precip_mm_h > 5:
+            scores[REASON_CODES['WEATHER_IMPACT']] = 0.65
+        
+        if weather_impact.wind_kmh > 40:
+            scores[REASON_CODES['WEATHER_IMPACT']] = max(
+                scores.get(REASON_CODES['WEATHER_IMPACT'], 0), 0.80)
     
-    # Check facility dwell (look for completed stops with extended dwell)
+    # Check facility dwell (look for recently completed stops with extended dwell)
+    dwell_cutoff = datetime.utcnow() - timedelta(minutes=DWELL_LOOKBACK_MIN)
     for stop in stops:
         if stop.get('completed') and stop.get('actual_arr_ts') and stop.get('actual_dep_ts'):
-            arr = stop['actual_arr_ts']
-            dep = stop['actual_dep_ts']
-            if isinstance(arr, str):
-                arr = datetime.fromisoformat(arr.replace('Z', '+00:00'))
-            if isinstance(dep, str):
-                dep = datetime.fromisoformat(dep.replace('Z', '+00:00'))
+            dep = _ensure_datetime(stop, 'actual_dep_ts')
+            if dep.replace(tzinfo=None) < dwell_cutoff:
+                continue
+            arr = _ensure_datetime(stop, 'actual_arr_ts')
             
             actual_dwell_min = (dep - arr).total_seconds() / 60
             planned_service = stop.get('planned_service_min', 30)
@@ -279,7 +377,7 @@ def score_delay_reason(shipment: Dict, stops: List[Dict],
         else:
             explanation = f"Traffic congestion is causing approximately {late_by_min} minutes of delay."
     elif reason_code == REASON_CODES['WEATHER_IMPACT']:
-        explanation = f"Weather conditions ({weather_impact}) are causing approximately {late_by_min} minutes of delay."
+        explanation = f"Weather conditions ({weather_impact.label}) are causing approximately {late_by_min} minutes of delay."
     elif reason_code == REASON_CODES['FACILITY_DWELL']:
         explanation = f"Extended dwell time at previous stop is adding {late_by_min} minutes to the schedule."
     else:
@@ -287,6 +385,181 @@ def score_delay_reason(shipment: Dict, stops: List[Dict],
     
     return (reason_code, confidence, explanation)
 
+# ==================== Socket.IO Emit Throttling ====================
+
+# At most one position_update per shipment per interval; newer payloads replace pending ones
+EMIT_MIN_INTERVAL_S = 1.0
+_last_emit: Dict[int, float] = {}
+_pending_emits: Dict[int, Dict] = {}
+_emit_lock = threading.Lock()
+
+# shipment_id -> subscribed socket sids, mirrored from join_room/leave_room so
+# updates for shipments nobody is watching are dropped before encoding
+shipment_subscribers: Dict[int, Set[str]] = defaultdict(set)
+_subscribers_lock = threading.Lock()
+
+def _emit_now(shipment_id: int, payload: Dict):
+    socketio.emit('position_update', payload, room=f"shipment_{shipment_id}", namespace='/')
+
+def emit_position_update(shipment_id: int, payload: Dict):
+    """Emit a position_update, or hold it for the flusher if the shipment emitted recently"""
+    if not shipment_subscribers.get(shipment_id):
+        return
+    now = time.monotonic()
+    with _emit_lock:
+        if now - _last_emit.get(shipment_id, 0.0) < EMIT_MIN_INTERVAL_S:
+            _pending_emits[shipment_id] = payload
+            return
+        _last_emit[shipment_id] = now
+        _pending_emits.pop(shipment_id, None)
+    _emit_now(shipment_id, payload)
+
+def position_emit_flusher():
+    """Send held position updates once their shipment's interval has elapsed"""
+    while True:
+        time.sleep(EMIT_MIN_INTERVAL_S)
+        now = time.monotonic()
+        due = []
+        with _emit_lock:
+            for shipment_id in list(_pending_emits):
+                if now - _last_emit.get(shipment_id, 0.0) >= EMIT_MIN_INTERVAL_S:
+                    due.append((shipment_id, _pending_emits.pop(shipment_id)))
+                    _last_emit[shipment_id] = now
+        for shipment_id, payload in due:
+            _emit_now(shipment_id, payload)
+
+threading.Thread(target=position_emit_flusher, name='emit-flusher', daemon=True).start()
+
+# ==================== Background ETA Recompute ====================
+
+# Vehicles with fresh positions; bursts are coalesced to one recompute per vehicle
+recompute_queue = queue.Queue()
+RECOMPUTE_DEBOUNCE_S = 2.0
+# Scored ETA rows are written in one INSERT/commit per this many rows (or per debounce cycle)
+ETA_FLUSH_ROWS = 100
+
+def recompute_vehicle_etas(vehicle_id: int) -> Optional[Tuple[List[Tuple], int, Dict]]:
+    """
+    Recompute and score ETAs for the vehicle's active shipment
+
+    Returns (eta_rows, shipment_id, position_update payload), or None if the
+    vehicle has no active shipment. The caller stores the rows and emits.
+    """
+    shipment_id = active_shipment_for(vehicle_id)
+    shipment = db.get_shipment(shipment_id) if shipment_id else None
+    if shipment and shipment['status'] not in ('pending', 'in_transit'):
+        # Finished since it was cached; forget it so the next fix looks up a new one
+        active_shipment_cache.pop(vehicle_id)
+        shipment = None
+    if shipment:
+        # Get latest position
+        latest_pos = db.get_latest_position(vehicle_id)
+        
+        # Get stops
+        stops = db.get_shipment_stops(shipment['id'])
+        
+        # Get vehicle constraints (use defaults for now)
+        constraints = DEFAULT_CONSTRAINTS
+        
+        # Compute ETAs with routing and weather
+        etas = compute_eta_with_routing(latest_pos, stops, constraints)
+        
+        # Get traffic data for delay scoring (sample from current position to next stop)
+        next_incomplete_stop = next((s for s in stops if not s.get('completed')), None)
+        traffic_data = None
+        if next_incomplete_stop:
+            waypoints = [(latest_pos['lat'], latest_pos['lon']), 
+                       (next_incomplete_stop['lat'], next_incomplete_stop['lon'])]
+            traffic_data = traffic_api.get_traffic_on_route(waypoints)
+        
+        # Score delay reasons
+        eta_rows = []
+        for eta in etas:
+            if not eta.get('eta_ts'):
+                continue
+                
+            # Determine delay reason with weather and traffic impact
+            weather_impact = eta.get('weather_impact')
+            reason_code, confidence, explanation = score_delay_reason(
+                shipment, stops, latest_pos, eta['late_by_min'], 
+                weather_impact, traffic_data
+            )
+            
+            eta_rows.append((
+                shipment['id'],
+                eta['stop_id'],
+                eta['eta_ts'],
+                eta['on_time'],
+                eta['late_by_min'],
+                reason_code,
+                confidence,
+                explanation
+            ))
+        
+        return eta_rows, shipment['id'], {
+            'shipment_id': shipment['id'],
+            'vehicle_position': {
+                'lat': latest_pos['lat'],
+                'lon': latest_pos['lon'],
+                'speed_kph': latest_pos.get('speed_kph') or 0,
+                'heading_deg': latest_pos.get('heading_deg') or 0
+            },
+            'timestamp': latest_pos['ts'].isoformat()  # msgpack has no datetime type
+        }
+    return None
+
+def flush_eta_updates(eta_rows: List[Tuple], updates: List[Tuple[int, Dict]]):
+    """Store buffered ETA rows in one transaction, then send their position updates"""
+    try:
+        db.insert_etas_bulk(eta_rows)
+    except Exception:
+        logger.exception('Storing %d recomputed ETAs failed', len(eta_rows))
+        return
+    # Real-time update via Socket.IO (rate-limited per shipment)
+    for shipment_id, payload in updates:
+        emit_position_update(shipment_id, payload)
+
+def eta_recompute_worker():
+    """
+    Drain recompute_queue forever
+    
+    After the first vehicle arrives, keep collecting for RECOMPUTE_DEBOUNCE_S so a
+    burst of GPS fixes triggers a single recompute per vehicle. ETAs from the
+    whole cycle are stored together, every ETA_FLUSH_ROWS rows and at the end.
+    """
+    while True:
+        vehicles = {recompute_queue.get()}
+        deadline = time.monotonic() + RECOMPUTE_DEBOUNCE_S
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                vehicles.add(recompute_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        eta_rows, updates = [], []
+        for vehicle_id in vehicles:
+            try:
+                result = recompute_vehicle_etas(vehicle_id)
+            except Exception:
+                logger.exception('ETA recompute failed for vehicle %s', vehicle_id)
+                continue
+            if result is None:
+                continue
+            rows, shipment_id, payload = result
+            eta_rows.extend(rows)
+            updates.append((shipment_id, payload))
+            if len(eta_rows) >= ETA_FLUSH_ROWS:
+                flush_eta_updates(eta_rows, updates)
+                eta_rows, updates = [], []
+        
+        if updates:
+            flush_eta_updates(eta_rows, updates)
+
+threading.Thread(target=eta_recompute_worker, name='eta-recompute', daemon=True).start()
+
 # ==================== API Endpoints ====================
 
 @app.route('/v1/shipments', methods=['GET', 'POST'])
@@ -305,44 +578,20 @@ def shipments():
             return jsonify({'success': False, 'error': 'ref parameter required'}), 400
         
         try:
-            # Rollback any existing transaction to ensure clean state
-            db.conn.rollback()
-            
             # Query database for shipment by reference
-            with db.conn.cursor() as cur:
+            # Rows come back as dicts; org_id is aliased to the organization_id the frontend expects
+            with db.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("""
-                    SELECT id, ref, vehicle_id, org_id, status, 
+                    SELECT id, ref, vehicle_id, org_id AS organization_id, status, 
                            created_at::text, updated_at::text
                     FROM shipments
                     WHERE ref = %s
                     ORDER BY created_at DESC
                 """, (ref,))
                 
-                rows = cur.fetchall()
-                
-                # Commit the read transaction
-                db.conn.commit()
-                
-                if not rows:
-                    return jsonify([]), 200
-                
-                # Convert rows to dictionaries
-                shipments = []
-                for row in rows:
-                    shipments.append({
-                        'id': row[0],
-                        'ref': row[1],
-                        'vehicle_id': row[2],
-                        'organization_id': row[3],  # Frontend expects organization_id
-                        'status': row[4],
-                        'created_at': row[5],
-                        'updated_at': row[6]
-                    })
-                
-                return jsonify(shipments), 200
+                return jsonify(cur.fetchall()), 200
                 
         except Exception as e:
-            db.conn.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
     
     # POST - Create shipment
@@ -361,6 +610,8 @@ def shipments():
             stops=data['stops'],
             promised_eta_ts=data['promised_eta_ts']
         )
+        active_shipment_cache.set(data['vehicle_id'], result['shipment_id'])
+        no_active_shipment_cache.pop(data['vehicle_id'])
         
         # Log event
         db.log_event(result['shipment_id'], 'shipment_created', {
@@ -382,7 +633,7 @@ def shipments():
 def ingest_positions():
     """
     POST /v1/positions
-    Ingest GPS positions (batch)
+    Ingest GPS positions (batch); returns 202 and recomputes ETAs in the background
     
     Body: {
         "vehicle_id": 1,
@@ -396,107 +647,82 @@ def ingest_positions():
         vehicle_id = data['vehicle_id']
         points = data['points']
         
-        # Snap GPS points to road network for accuracy
-        snapped_points = []
-        for point in points:
-            snapped_lat, snapped_lon = router.snap_to_road(point['lat'], point['lon'])
-            snapped_points.append({
+        # Snap GPS points to road network for accuracy (one batched request)
+        snapped = router.snap_to_road_batch([(point['lat'], point['lon']) for point in points])
+        snapped_points = [
+            {
                 'ts': point['ts'],
                 'lat': snapped_lat,
                 'lon': snapped_lon,
                 'speed_kph': point.get('speed_kph', 0)
-            })
+            }
+            for point, (snapped_lat, snapped_lon) in zip(points, snapped)
+        ]
         
         # Insert snapped positions
         count = db.insert_positions(vehicle_id, snapped_points)
         
-        # Trigger ETA recompute for active shipments with this vehicle
-        shipment = db.get_shipment_by_ref('PO-98765')  # TODO: Get actual active shipment
-        if shipment and shipment['vehicle_id'] == vehicle_id:
-            # Get latest position
-            latest_pos = db.get_latest_position(vehicle_id)
-            
-            # Get stops
-            stops = db.get_shipment_stops(shipment['id'])
-            
-            # Get vehicle constraints (use defaults for now)
-            constraints = VehicleConstraints()
-            
-            # Compute ETAs with routing and weather
-            etas = compute_eta_with_routing(latest_pos, stops, constraints)
-            
-            # Get traffic data for delay scoring (sample from current position to next stop)
-            next_incomplete_stop = next((s for s in stops if not s.get('completed')), None)
-            traffic_data = None
-            if next_incomplete_stop:
-                waypoints = [(latest_pos['lat'], latest_pos['lon']), 
-                           (next_incomplete_stop['lat'], next_incomplete_stop['lon'])]
-                traffic_data = traffic_api.get_traffic_on_route(waypoints)
-            
-            # Store ETAs and emit updates
-            for eta in etas:
-                if not eta.get('eta_ts'):
-                    continue
-                    
-                # Determine delay reason with weather and traffic impact
-                weather_impact = eta.get('weather_impact')
-                reason_code, confidence, explanation = score_delay_reason(
-                    shipment, stops, latest_pos, eta['late_by_min'], 
-                    weather_impact, traffic_data
-                )
-                
-                # Insert ETA
-                db.insert_eta(
-                    shipment['id'],
-                    eta['stop_id'],
-                    eta['eta_ts'],
-                    eta['on_time'],
-                    eta['late_by_min'],
-                    reason_code,
-                    confidence,
-                    explanation
-                )
-            
-            # Emit real-time update via Socket.IO
-            socketio.emit('position_update', {
-                'shipment_id': shipment['id'],
-                'vehicle_position': {
-                    'lat': float(latest_pos['lat']),
-                    'lon': float(latest_pos['lon']),
-                    'speed_kph': float(latest_pos['speed_kph']) if latest_pos.get('speed_kph') is not None else 0,
-                    'heading_deg': float(latest_pos['heading_deg']) if latest_pos.get('heading_deg') is not None else 0
-                },
-                'timestamp': latest_pos['ts'].isoformat()
-            }, room=f"shipment_{shipment['id']}")
+        # ETA recompute (routing, weather, traffic, scoring) runs on the background worker
+        if active_shipment_for(vehicle_id) is not None:
+            recompute_queue.put(vehicle_id)
         
         return jsonify({
             'success': True,
             'positions_inserted': count
-        }), 200
+        }), 202
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+# Status polls revalidate with If-None-Match; unchanged shipments get an empty 304
+STATUS_CACHE_CONTROL = 'private, no-cache'
+# Fallback ETAs are projected from the request time, so tags also roll over per time bucket
+STATUS_ETAG_BUCKET_S = 60
+
+def status_etag(bundle: Dict, now: datetime) -> str:
+    """
+    Validator for a status bundle
+
+    Changes with any new position, ETA, stop event or shipment update, and
+    every STATUS_ETAG_BUCKET_S so now-derived timestamps in the body don't go stale.
+    """
+    shipment = bundle['shipment']
+    position = bundle['position']
+    state = (
+        int(now.timestamp() // STATUS_ETAG_BUCKET_S),
+        shipment['status'],
+        shipment.get('updated_at'),
+        position['id'] if position else None,
+        max((eta['id'] for eta in bundle['latest_etas'].values()), default=None),
+        tuple((s['id'], s.get('completed'), s.get('actual_arr_ts')) for s in bundle['stops'])
+    )
+    return hashlib.blake2b(repr(state).encode(), digest_size=8).hexdigest()
+
 @app.route('/v1/shipments/<int:shipment_id>/status', methods=['GET'])
 def get_shipment_status(shipment_id):
     """
     GET /v1/shipments/{id}/status
     Get current shipment status with ETA and delay reason
     """
+    now = datetime.utcnow()
     try:
-        # Rollback any existing transaction
-        db.conn.rollback()
-        
-        # Get shipment
-        shipment = db.get_shipment(shipment_id)
-        if not shipment:
+        # Shipment, stops, latest ETAs and vehicle position in one query
+        bundle = db.get_shipment_status_bundle(shipment_id)
+        if not bundle:
             return jsonify({'success': False, 'error': 'Shipment not found'}), 404
-        
-        # Get stops
-        stops = db.get_shipment_stops(shipment_id)
+
+        shipment = bundle['shipment']
+        stops = bundle['stops']
         if not stops:
             return jsonify({'success': False, 'error': 'No stops found'}), 404
         
+        etag = status_etag(bundle, now)
+        if etag in request.if_none_match:
+            not_modified = Response(status=304)
+            not_modified.set_etag(etag)
+            not_modified.headers['Cache-Control'] = STATUS_CACHE_CONTROL
+            return not_modified
+        
         # Find current leg (first uncompleted stop)
         current_stop_idx = 0
         for i, stop in enumerate(stops):
@@ -507,31 +733,20 @@ def get_shipment_status(shipment_id):
         current_stop = stops[current_stop_idx]
         prev_stop = stops[current_stop_idx - 1] if current_stop_idx > 0 else None
         
-        # Get latest ETA for current stop
-        eta = db.get_latest_eta(shipment_id, current_stop['id'])
-        
-        # Get current vehicle position
-        vehicle_pos = db.get_latest_position(shipment['vehicle_id'])
+        # Latest ETA for current stop and current vehicle position
+        eta = bundle['latest_etas'].get(current_stop['id'])
+        vehicle_pos = bundle['position']
         
         # Calculate simple ETA if no ETA data exists
         if not eta and vehicle_pos:
             # Simple distance-based ETA calculation (assuming 80 km/h average speed)
-            import math
-            def haversine_distance(lat1, lon1, lat2, lon2):
-                R = 6371  # Earth radius in km
-                dlat = math.radians(float(lat2) - float(lat1))
-                dlon = math.radians(float(lon2) - float(lon1))
-                a = math.sin(dlat/2)**2 + math.cos(math.radians(float(lat1))) * math.cos(math.radians(float(lat2))) * math.sin(dlon/2)**2
-                c = 2 * math.asin(math.sqrt(a))
-                return R * c
-            
-            distance_km = haversine_distance(
-                vehicle_pos['lat'], vehicle_pos['lon'],
-                current_stop['lat'], current_stop['lon']
+            distance_km = haversine_km(
+                float(vehicle_pos['lat']), float(vehicle_pos['lon']),
+                float(current_stop['lat']), float(current_stop['lon'])
             )
             avg_speed_kph = 80
             eta_hours = distance_km / avg_speed_kph
-            eta_ts = datetime.utcnow() + timedelta(hours=eta_hours)
+            eta_ts = now + timedelta(hours=eta_hours)
             
             eta = {
                 'eta_ts': eta_ts,
@@ -559,7 +774,7 @@ def get_shipment_status(shipment_id):
                 'lat': float(vehicle_pos['lat']) if vehicle_pos and vehicle_pos.get('lat') is not None else None,
                 'lon': float(vehicle_pos['lon']) if vehicle_pos and vehicle_pos.get('lon') is not None else None,
                 'speed_kph': float(vehicle_pos['speed_kph']) if vehicle_pos and vehicle_pos.get('speed_kph') is not None else 0,
-                'timestamp': vehicle_pos['ts'].isoformat() if vehicle_pos and vehicle_pos.get('ts') else None
+                'timestamp': vehicle_pos.get('ts')
             } if vehicle_pos else None,
             'next_stop': {
                 'name': current_stop['name'],
@@ -567,7 +782,7 @@ def get_shipment_status(shipment_id):
                 'lon': float(current_stop['lon']) if current_stop.get('lon') is not None else None,
                 'seq': current_stop['seq']
             },
-            'eta_next_stop_ts': eta['eta_ts'].isoformat() if eta else None,
+            'eta_next_stop_ts': eta['eta_ts'] if eta else None,
             'on_time': eta['on_time_bool'] if eta else True,
             'late_by_min': eta['late_by_min'] if eta else 0,
             'reason_code': eta['reason_code'] if eta else REASON_CODES['ON_TIME'],
@@ -578,84 +793,60 @@ def get_shipment_status(shipment_id):
         
         # Add stops with calculated ETAs
         if vehicle_pos:
-            import math as m  # Import at function level to avoid scope issues
-            def haversine_distance(lat1, lon1, lat2, lon2):
-                R = 6371  # Earth radius in km
-                dlat = m.radians(float(lat2) - float(lat1))
-                dlon = m.radians(float(lon2) - float(lon1))
-                a = m.sin(dlat/2)**2 + m.cos(m.radians(float(lat1))) * m.cos(m.radians(float(lat2))) * m.sin(dlon/2)**2
-                c = 2 * m.asin(m.sqrt(a))
-                return R * c
-            
             avg_speed_kph = 80
-            current_pos = vehicle_pos
-            cumulative_time_seconds = 0  # Track cumulative travel time
+            
+            # Leg distances along vehicle -> each pending delivery stop, then cumulative
+            # drive time in one vectorized pass
+            route_stops = [s for idx, s in enumerate(stops) if idx > 0 and not s.get('completed')]
+            terms = [trig_terms(float(vehicle_pos['lat']), float(vehicle_pos['lon']))]
+            terms += [(s['lat_rad'], s['lon_rad'], s['cos_lat']) for s in route_stops]
+            leg_km = haversine_vec_rad(*zip(*terms))
+            leg_seconds = (leg_km / avg_speed_kph * 3600).astype(int)
+            cumulative_seconds = np.cumsum(leg_seconds)
+            route_eta = {
+                s['id']: (int(eta_seconds), now + timedelta(seconds=int(cum_seconds)))
+                for s, eta_seconds, cum_seconds in zip(route_stops, leg_seconds, cumulative_seconds)
+            }
             
             for idx, s in enumerate(stops):
-                # First stop is the origin/starting point
-                is_origin = (idx == 0)
+                stop_entry = {
+                    'seq': s['seq'],
+                    'name': s['name'],
+                    'lat': float(s['lat']) if s.get('lat') is not None else None,
+                    'lon': float(s['lon']) if s.get('lon') is not None else None,
+                    'completed': bool(s.get('completed')),
+                    'planned_arr_ts': s.get('planned_arr_ts'),
+                    'actual_arr_ts': None,
+                }
                 
                 if s.get('completed'):
                     # Completed stop
-                    response['stops'].append({
-                        'seq': s['seq'],
-                        'name': s['name'],
-                        'lat': float(s['lat']) if s.get('lat') is not None else None,
-                        'lon': float(s['lon']) if s.get('lon') is not None else None,
-                        'completed': True,
-                        'planned_arr_ts': s['planned_arr_ts'].isoformat() if s.get('planned_arr_ts') else None,
-                        'actual_arr_ts': s['actual_arr_ts'].isoformat() if s.get('actual_arr_ts') else None,
+                    stop_entry.update({
+                        'actual_arr_ts': s.get('actual_arr_ts'),
                         'eta_seconds': 0,
-                        'eta_timestamp': s['actual_arr_ts'].isoformat() if s.get('actual_arr_ts') else None,
-                        'arrival_time': s['actual_arr_ts'].isoformat() if s.get('actual_arr_ts') else None,
-                        'is_origin': is_origin
+                        'eta_timestamp': s.get('actual_arr_ts'),
+                        'arrival_time': s.get('actual_arr_ts'),
+                        'is_origin': idx == 0
                     })
-                elif is_origin:
+                elif idx == 0:
                     # First stop is the origin - truck starts here
-                    from datetime import datetime
-                    response['stops'].append({
-                        'seq': s['seq'],
-                        'name': s['name'],
-                        'lat': float(s['lat']) if s.get('lat') is not None else None,
-                        'lon': float(s['lon']) if s.get('lon') is not None else None,
-                        'completed': False,
-                        'planned_arr_ts': s['planned_arr_ts'].isoformat() if s.get('planned_arr_ts') else None,
-                        'actual_arr_ts': None,
+                    stop_entry.update({
                         'eta_seconds': 0,
-                        'eta_timestamp': datetime.utcnow().isoformat(),
+                        'eta_timestamp': now,
                         'stop_sequence': s['seq'],
                         'is_origin': True,
                         'status': 'Origin (Departed)'
                     })
                 else:
-                    # Calculate ETA based on distance from current position
-                    distance_km = haversine_distance(
-                        current_pos['lat'], current_pos['lon'],
-                        s['lat'], s['lon']
-                    )
-                    eta_hours = distance_km / avg_speed_kph
-                    eta_seconds = int(eta_hours * 3600)
-                    cumulative_time_seconds += eta_seconds
-                    
-                    # Calculate actual arrival timestamp
-                    from datetime import datetime, timedelta
-                    eta_timestamp = datetime.utcnow() + timedelta(seconds=cumulative_time_seconds)
-                    
-                    response['stops'].append({
-                        'seq': s['seq'],
-                        'name': s['name'],
-                        'lat': float(s['lat']) if s.get('lat') is not None else None,
-                        'lon': float(s['lon']) if s.get('lon') is not None else None,
-                        'completed': False,
-                        'planned_arr_ts': s['planned_arr_ts'].isoformat() if s.get('planned_arr_ts') else None,
-                        'actual_arr_ts': None,
+                    eta_seconds, eta_timestamp = route_eta[s['id']]
+                    stop_entry.update({
                         'eta_seconds': eta_seconds,
-                        'eta_timestamp': eta_timestamp.isoformat(),
+                        'eta_timestamp': eta_timestamp,
                         'stop_sequence': s['seq'],
                         'is_origin': False
                     })
-                    # Update position for next stop calculation (cumulative)
-                    current_pos = {'lat': s['lat'], 'lon': s['lon']}
+                
+                response['stops'].append(stop_entry)
         else:
             # No vehicle position, return stops without ETA
             for s in stops:
@@ -665,21 +856,19 @@ def get_shipment_status(shipment_id):
                     'lat': float(s['lat']) if s.get('lat') is not None else None,
                     'lon': float(s['lon']) if s.get('lon') is not None else None,
                     'completed': s.get('completed', False),
-                    'planned_arr_ts': s['planned_arr_ts'].isoformat() if s.get('planned_arr_ts') else None,
-                    'actual_arr_ts': s['actual_arr_ts'].isoformat() if s.get('actual_arr_ts') else None,
+                    'planned_arr_ts': s.get('planned_arr_ts'),
+                    'actual_arr_ts': s.get('actual_arr_ts'),
                     'eta_seconds': None,
                     'stop_sequence': s['seq']
                 })
         
-        # Commit the read transaction
-        db.conn.commit()
-        
-        return jsonify(response), 200
+        resp = orjson_response(response)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = STATUS_CACHE_CONTROL
+        return resp
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        db.conn.rollback()
+        logger.exception('status failed for shipment %s', shipment_id)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/v1/shipments/<int:shipment_id>/traffic', methods=['GET'])
@@ -701,47 +890,21 @@ def get_traffic_segments(shipment_id):
         traffic_data = traffic_api.get_traffic_on_route(waypoints)
         
         # Generate mock traffic segments for visualization (simulating real traffic API response)
-        # In production, this would come from the traffic provider
-        segments = []
+        # In production, this would come from the traffic provider.
+        # Route-level congestion and speeds are the same for every segment, so resolve them once.
+        speed_factor, color, level = CONGESTION_STYLES.get(
+            traffic_data.get('congestion_level', 'none'), CONGESTION_STYLES['none'])
+        current_speed_kph = int(traffic_data.get('average_speed_kph', 80) * speed_factor)
+        freeflow_speed_kph = int(traffic_data.get('freeflow_speed_kph', 80))
         
-        for i in range(len(waypoints) - 1):
-            start = waypoints[i]
-            end = waypoints[i + 1]
-            
-            # Calculate segment midpoint for traffic sampling
-            mid_lat = (start[0] + end[0]) / 2
-            mid_lon = (start[1] + end[1]) / 2
-            
-            # Simulate traffic levels based on congestion data
-            congestion = traffic_data.get('congestion_level', 'none')
-            if congestion == 'heavy':
-                speed_factor = 0.3
-                color = '#DC2626'  # Red
-                level = 'heavy'
-            elif congestion == 'moderate':
-                speed_factor = 0.6
-                color = '#F59E0B'  # Orange
-                level = 'moderate'
-            elif congestion == 'light':
-                speed_factor = 0.8
-                color = '#FBBF24'  # Yellow
-                level = 'light'
-            else:
-                speed_factor = 1.0
-                color = '#10B981'  # Green
-                level = 'none'
-            
-            segments.append({
-                'start': {'lat': start[0], 'lon': start[1]},
-                'end': {'lat': end[0], 'lon': end[1]},
-                'traffic_level': level,
-                'color': color,
-                'speed_factor': speed_factor,
-                'current_speed_kph': int(traffic_data.get('average_speed_kph', 80) * speed_factor),
-                'freeflow_speed_kph': int(traffic_data.get('freeflow_speed_kph', 80))
-            })
+        points = [Coord(lat, lon) for lat, lon in waypoints]
+        segments = [
+            TrafficSegment(start, end, level, color, speed_factor,
+                           current_speed_kph, freeflow_speed_kph)
+            for start, end in zip(points, points[1:])
+        ]
         
-        return jsonify({
+        return orjson_response({
             'success': True,
             'shipment_id': shipment_id,
             'traffic_summary': {
@@ -750,13 +913,38 @@ def get_traffic_segments(shipment_id):
                 'freeflow_speed_kph': traffic_data.get('freeflow_speed_kph', 80)
             },
             'segments': segments
-        }), 200
+        })
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception('segments failed for shipment %s', shipment_id)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def get_route_alternatives(shipment_id: int, lane_start: Tuple[float, float],
+                           origin: Tuple[float, float], destination: Tuple[float, float],
+                           constraints: VehicleConstraints) -> List[Dict]:
+    """
+    Primary route plus alternatives from origin to destination, cached per lane
+
+    The key uses the leg's fixed lane_start rather than the vehicle's live
+    position, so it stays stable while the truck moves; the router is only
+    asked (from the live origin) on a miss.
+    """
+    key = (quantize(*lane_start), quantize(*destination), constraints)
+    reroute_key_by_shipment.set(shipment_id, key)
+    
+    alternatives = reroute_cache.get(key)
+    if alternatives is None:
+        alternatives = router.calculate_alternatives([origin, destination], constraints)
+        if alternatives:
+            reroute_cache.set(key, alternatives)
+    return alternatives
+
+def invalidate_route_alternatives(shipment_id: int) -> None:
+    """Drop the cached comparison for a shipment once its route changes"""
+    key = reroute_key_by_shipment.pop(shipment_id)
+    if key is not None:
+        reroute_cache.pop(key)
+
 @app.route('/v1/reroute/suggest', methods=['POST'])
 def suggest_reroute():
     """
@@ -783,37 +971,69 @@ def suggest_reroute():
         shipment_id = data['shipment_id']
         min_time_saved = data.get('min_time_saved_min', 10)
         
-        # TODO: Implement Valhalla routing comparison
-        # For now, return placeholder response
-        
         # Get current ETA
         shipment = db.get_shipment(shipment_id)
         stops = db.get_shipment_stops(shipment_id)
-        next_stop = next((s for s in stops if not s.get('completed')), None)
+        next_idx = next((i for i, s in enumerate(stops) if not s.get('completed')), None)
         
-        if not next_stop:
+        if next_idx is None:
             return jsonify({
                 'success': True,
                 'reroute_available': False,
                 'reason': 'No pending stops'
             }), 200
         
+        next_stop = stops[next_idx]
         current_eta = db.get_latest_eta(shipment_id, next_stop['id'])
+        if not current_eta:
+            # Savings are applied to the stored ETA; none has been computed for this stop yet
+            return jsonify({
+                'success': True,
+                'reroute_available': False,
+                'reason': 'No ETA computed for the next stop yet'
+            }), 200
         
-        # Placeholder: simulate finding alternative route
-        # In production, this calls Valhalla with different routing options
-        time_saved_min = 12  # Simulated
+        # Compare the default truck route against the router's alternatives from the vehicle's position
+        requested = data.get('constraints') or {}
+        constraints = VehicleConstraints(
+            height_m=requested.get('max_height_m', VehicleConstraints.height_m),
+            avoid_tolls=requested.get('avoid_tolls', False)
+        )
+        latest_pos = db.get_latest_position(shipment['vehicle_id'])
+        origin_stop = latest_pos or stops[0]
+        lane_start = stops[next_idx - 1] if next_idx > 0 else None
+        alternatives = get_route_alternatives(
+            shipment_id,
+            (lane_start['lat'], lane_start['lon']) if lane_start
+            else quantize(origin_stop['lat'], origin_stop['lon'], REROUTE_ORIGIN_CELL_DIGITS),
+            (origin_stop['lat'], origin_stop['lon']),
+            (next_stop['lat'], next_stop['lon']),
+            constraints
+        )
+        
+        if len(alternatives) < 2:
+            return jsonify({
+                'success': True,
+                'reroute_available': False,
+                'reason': 'No alternative route found'
+            }), 200
+        
+        primary = alternatives[0]
+        best = min(alternatives[1:], key=lambda alt: alt['duration_min'])
+        time_saved_min = round(primary['duration_min'] - best['duration_min'])
         
         if time_saved_min >= min_time_saved:
-            new_eta_ts = datetime.fromisoformat(current_eta['eta_ts'].replace('Z', '+00:00')) - timedelta(minutes=time_saved_min)
+            # etas.eta_ts comes back from psycopg2 as a naive UTC datetime
+            old_eta_ts = current_eta['eta_ts']
+            new_eta_ts = old_eta_ts - timedelta(minutes=time_saved_min)
             
             # Store reroute suggestion
             reroute_id = db.insert_reroute(
                 shipment_id,
-                current_eta['eta_ts'],
+                old_eta_ts,
                 new_eta_ts,
                 time_saved_min,
-                "Alternative route via US-90 avoids traffic congestion"
+                f"{best['name']}: {best['reason']}"
             )
             
             return jsonify({
@@ -821,14 +1041,11 @@ def suggest_reroute():
                 'reroute_available': True,
                 'reroute_id': reroute_id,
                 'time_saved_min': time_saved_min,
-                'old_eta_ts': current_eta['eta_ts'].isoformat(),
-                'new_eta_ts': new_eta_ts.isoformat(),
-                'summary': "Alternative route via US-90 saves 12 minutes by avoiding traffic",
-                'instructions': [
-                    "Take exit 783 for US-90",
-                    "Continue on US-90 E for 15.3 miles",
-                    "Merge back onto I-10 E"
-                ]
+                'old_eta_ts': old_eta_ts,
+                'new_eta_ts': new_eta_ts,
+                'new_path': simplify_geometry(best, REROUTE_PATH_TOLERANCE_M),
+                'summary': f"{best['name']} saves {time_saved_min} minutes",
+                'instructions': [step['instruction'] for step in best['route'].get('instructions', [])]
             }), 200
         else:
             return jsonify({
@@ -845,9 +1062,10 @@ def suggest_reroute():
 def accept_reroute(reroute_id):
     """Accept a reroute suggestion"""
     try:
-        success = db.accept_reroute(reroute_id)
+        shipment_id = db.accept_reroute(reroute_id)
         
-        if success:
+        if shipment_id is not None:
+            invalidate_route_alternatives(shipment_id)
             return jsonify({'success': True, 'message': 'Reroute accepted'}), 200
         else:
             return jsonify({'success': False, 'error': 'Failed to accept reroute'}), 500
@@ -859,12 +1077,17 @@ def accept_reroute(reroute_id):
 
 @socketio.on('connect')
 def handle_connect():
-    print(f'Client connected: {request.sid}')
+    logger.info('Client connected: %s', request.sid)
     emit('connected', {'message': 'Connected to ETA tracking server'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print(f'Client disconnected: {request.sid}')
+    logger.info('Client disconnected: %s', request.sid)
+    with _subscribers_lock:
+        for shipment_id, sids in list(shipment_subscribers.items()):
+            sids.discard(request.sid)
+            if not sids:
+                del shipment_subscribers[shipment_id]
 
 @socketio.on('subscribe')
 def handle_subscribe(data):
@@ -873,7 +1096,9 @@ def handle_subscribe(data):
     if shipment_id:
         room = f"shipment_{shipment_id}"
         join_room(room)
-        print(f'Client {request.sid} subscribed to {room}')
+        with _subscribers_lock:
+            shipment_subscribers[int(shipment_id)].add(request.sid)
+        logger.info('Client %s subscribed to %s', request.sid, room)
         emit('subscribed', {'shipment_id': shipment_id, 'room': room})
 
 @socketio.on('unsubscribe')
@@ -883,7 +1108,13 @@ def handle_unsubscribe(data):
     if shipment_id:
         room = f"shipment_{shipment_id}"
         leave_room(room)
-        print(f'Client {request.sid} unsubscribed from {room}')
+        with _subscribers_lock:
+            sids = shipment_subscribers.get(int(shipment_id))
+            if sids is not None:
+                sids.discard(request.sid)
+                if not sids:
+                    del shipment_subscribers[int(shipment_id)]
+        logger.info('Client %s unsubscribed from %s', request.sid, room)
         emit('unsubscribed', {'shipment_id': shipment_id})
 
 # ==================== Health Check ====================
@@ -909,31 +1140,46 @@ def get_config():
     }), 200
 
 if __name__ == '__main__':
-    print("=" * 60)
-    print("Live ETA & Delay Explanation System - Backend v1.0")
-    print("=" * 60)
-    print("\nStarting server...")
-    print(f"Database: Connected to PostgreSQL")
+    banner = [
+        "=" * 60,
+        "Live ETA & Delay Explanation System - Backend v1.0",
+        "=" * 60,
+        "\nStarting server...",
+        "Database: Connected to PostgreSQL",
+    ]
     
     # Show routing engine status
     if router.valhalla_url:
-        print(f"Routing: Valhalla (Truck costing enabled)")
-        print(f"  URL: {router.valhalla_url}")
+        banner += [
+            "Routing: Valhalla (Truck costing enabled)",
+            f"  URL: {router.valhalla_url}",
+        ]
     else:
-        print(f"Routing: OSRM (Fallback - limited truck support)")
-        print(f"  URL: {router.osrm_url}")
-        print(f"  Note: For full truck routing, run start_valhalla.bat")
+        banner += [
+            "Routing: OSRM (Fallback - limited truck support)",
+            f"  URL: {router.osrm_url}",
+            "  Note: For full truck routing, run start_valhalla.bat",
+        ]
     
-    print(f"\nAPI Endpoints:")
-    print(f"  GET/POST /v1/shipments")
-    print(f"  POST   /v1/positions")
-    print(f"  GET    /v1/shipments/<id>/status")
-    print(f"  POST   /v1/reroute/suggest")
-    print(f"  POST   /v1/reroutes/<id>/accept")
-    print(f"  GET    /health")
-    print(f"  GET    /v1/config")
-    print(f"\nSocket.IO Events:")
-    print(f"  connect, disconnect, subscribe, unsubscribe")
-    print("=" * 60)
+    banner += [
+        "\nAPI Endpoints:",
+        "  GET/POST /v1/shipments",
+        "  POST   /v1/positions",
+        "  GET    /v1/shipments/<id>/status",
+        "  POST   /v1/reroute/suggest",
+        "  POST   /v1/reroutes/<id>/accept",
+        "  GET    /health",
+        "  GET    /v1/config",
+        "\nSocket.IO Events:",
+        "  connect, disconnect, subscribe, unsubscribe",
+        "=" * 60,
+    ]
+    sys.stdout.write("\n".join(banner) + "\n")
+    sys.stdout.flush()
     
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
+    if SOCKETIO_ASYNC_MODE == 'gevent':
+        from gevent.pywsgi import WSGIServer
+        from geventwebsocket.handler import WebSocketHandler
+        WSGIServer(('0.0.0.0', 5000), app, handler_class=WebSocketHandler).serve_forever()
+    else:
+        socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
@@ -0,0 +1,224 @@
+"""
+Geodesic helpers shared by the ETA backend
+Haversine distance kernels, JIT-compiled with Numba when available
+"""
+import math
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # Numba is an optional accelerator; fall back to plain Python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+    prange = range
+
+EARTH_RADIUS_KM = 6371.0
+
+
+@njit(cache=True, fastmath=True)
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distance between two points in kilometers (Haversine formula)"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+@njit(cache=True, fastmath=True, parallel=True)
+def haversine_cum(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Cumulative distance in kilometers along a path of N points
+
+    Returns N-1 values; element i is the distance from point 0 to point i+1.
+    """
+    n = lats.shape[0]
+    legs = np.zeros(max(n - 1, 0))
+    for i in prange(n - 1):
+        legs[i] = haversine_km(lats[i], lons[i], lats[i + 1], lons[i + 1])
+    return np.cumsum(legs)
+
+
+def haversine_vec(lats, lons) -> np.ndarray:
+    """
+    Haversine distances in kilometers between consecutive points of a path
+
+    Takes arrays of N latitudes/longitudes (degrees) and returns the N-1 leg
+    distances in one vectorized pass; np.cumsum() gives cumulative distance.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    lat_rad = np.radians(lats)
+    dlat = np.radians(np.diff(lats))
+    dlon = np.radians(np.diff(lons))
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat_rad[:-1]) * np.cos(lat_rad[1:]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def haversine_from(lat: float, lon: float, lats, lons) -> np.ndarray:
+    """Haversine distances in kilometers from one point to each of N points"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    dlat = np.radians(lats - lat)
+    dlon = np.radians(lons - lon)
+
+    a = np.sin(dlat / 2) ** 2 + math.cos(math.radians(lat)) * np.cos(np.radians(lats)) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+@lru_cache(maxsize=4096)
+def trig_terms(lat: float, lon: float) -> Tuple[float, float, float]:
+    """
+    Pre-reduced (lat_rad, lon_rad, cos_lat) for a fixed coordinate
+
+    Stop coordinates never change, so repeated status polls hit the cache.
+    """
+    lat_rad = math.radians(lat)
+    return lat_rad, math.radians(lon), math.cos(lat_rad)
+
+
+def haversine_vec_rad(lat_rad, lon_rad, cos_lat) -> np.ndarray:
+    """
+    Same as haversine_vec, but for points already reduced by trig_terms()
+
+    Skips the per-call radians() and cos() work on every point.
+    """
+    lat_rad = np.asarray(lat_rad, dtype=np.float64)
+    lon_rad = np.asarray(lon_rad, dtype=np.float64)
+    cos_lat = np.asarray(cos_lat, dtype=np.float64)
+
+    dlat = np.diff(lat_rad)
+    dlon = np.diff(lon_rad)
+
+    a = np.sin(dlat / 2) ** 2 + cos_lat[:-1] * cos_lat[1:] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+@njit(cache=True)
+def _decode_polyline_bytes(data: np.ndarray, factor: float) -> Tuple[np.ndarray, np.ndarray]:
+    # Every value takes at least one byte, so a point takes at least two
+    lats = np.empty(data.shape[0] // 2, dtype=np.float64)
+    lons = np.empty(data.shape[0] // 2, dtype=np.float64)
+    index = 0
+    count = 0
+    lat = 0
+    lon = 0
+    while index < data.shape[0]:
+        for axis in range(2):
+            result = 0
+            shift = 0
+            while True:
+                # Compiled code has no bounds checks; a cut-off string must not read past the end
+                if index >= data.shape[0]:
+                    raise ValueError("truncated polyline")
+                b = int(data[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            delta = ~(result >> 1) if result & 1 else result >> 1
+            if axis == 0:
+                lat += delta
+            else:
+                lon += delta
+        lats[count] = lat / factor
+        lons[count] = lon / factor
+        count += 1
+    return lats[:count], lons[:count]
+
+
+def decode_polyline(encoded: str, precision: int = 6) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decode an encoded polyline (OSRM polyline6 / Valhalla shape) into lat and lon arrays
+
+    Walks the raw ASCII bytes once in a compiled loop instead of slicing the
+    string per coordinate. Raises ValueError if the string is truncated.
+    """
+    data = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8)
+    return _decode_polyline_bytes(data, float(10 ** precision))
+
+
+def encode_polyline(lats, lons, precision: int = 6) -> str:
+    """Encode lat/lon arrays as a polyline string (inverse of decode_polyline)"""
+    factor = 10 ** precision
+    points = np.column_stack((np.round(np.asarray(lats, dtype=np.float64) * factor),
+                              np.round(np.asarray(lons, dtype=np.float64) * factor))).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # Zig-zag sign folding, then 5-bit groups low to high
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist()
+    chars = []
+    for value in values:
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return ''.join(chars)
+
+
+@njit(cache=True)
+def _rdp_keep(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    # Iterative Ramer-Douglas-Peucker over planar coordinates; returns a keep mask
+    n = x.shape[0]
+    keep = np.zeros(n, dtype=np.bool_)
+    if n == 0:
+        return keep
+    keep[0] = True
+    keep[n - 1] = True
+    stack = np.empty((n, 2), dtype=np.int64)
+    stack[0, 0] = 0
+    stack[0, 1] = n - 1
+    top = 1
+    while top > 0:
+        top -= 1
+        start = stack[top, 0]
+        end = stack[top, 1]
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        length = math.sqrt(dx * dx + dy * dy)
+        max_dist = -1.0
+        index = -1
+        for i in range(start + 1, end):
+            if length == 0.0:
+                dist = math.sqrt((x[i] - x[start]) ** 2 + (y[i] - y[start]) ** 2)
+            else:
+                dist = abs(dy * (x[i] - x[start]) - dx * (y[i] - y[start])) / length
+            if dist > max_dist:
+                max_dist = dist
+                index = i
+        if index >= 0 and max_dist > tolerance:
+            keep[index] = True
+            stack[top, 0] = start
+            stack[top, 1] = index
+            stack[top + 1, 0] = index
+            stack[top + 1, 1] = end
+            top += 2
+    return keep
+
+
+def simplify_path(lats, lons, tolerance_m: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Drop path vertices that deviate less than tolerance_m from the simplified line
+
+    Points are projected onto a local equirectangular plane (meters) around
+    the path's mean latitude, which is accurate at route scale.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if lats.shape[0] < 3:
+        return lats, lons
+    meters_per_deg = EARTH_RADIUS_KM * 1000 * math.pi / 180
+    x = lons * math.cos(math.radians(float(lats.mean()))) * meters_per_deg
+    y = lats * meters_per_deg
+    keep = _rdp_keep(x, y, float(tolerance_m))
+    return lats[keep], lons[keep]
@@ -0,0 +1,84 @@
+"""
+Shared HTTP Session Factory
+Keep-alive connection pools for the routing, weather and traffic providers
+"""
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import requests_cache
+except ImportError:  # requests-cache is optional; without it sessions are uncached
+    requests_cache = None
+
+try:
+    import httpx
+except ImportError:  # httpx[http2] is optional; without it providers use requests sessions
+    httpx = None
+
+# Connections kept open per host; sized for the app's io_pool fan-out
+POOL_CONNECTIONS = 20
+POOL_MAXSIZE = 50
+
+# Transient provider failures (rate limiting, gateway errors) get two quick retries
+RETRY_TOTAL = 2
+RETRY_BACKOFF_S = 0.1
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Persistent HTTP cache lifetime for deterministic provider responses (routing)
+HTTP_CACHE_EXPIRE_S = 3600
+
+
+def make_session(pool_connections: int = POOL_CONNECTIONS,
+                 pool_maxsize: int = POOL_MAXSIZE,
+                 cache_name: Optional[str] = None) -> requests.Session:
+    """
+    requests.Session with pooled keep-alive adapters
+
+    Reusing one session per provider client skips the TCP/TLS handshake on
+    every call after the first. With cache_name (and requests-cache
+    installed) responses are also kept in a SQLite file of that name, so
+    identical GET/POST requests survive process restarts.
+    """
+    if cache_name and requests_cache is not None:
+        session = requests_cache.CachedSession(
+            cache_name, backend='sqlite', expire_after=HTTP_CACHE_EXPIRE_S,
+            allowable_methods=('GET', 'POST'), match_headers=False
+        )
+    else:
+        session = requests.Session()
+    session.headers.update({'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'})
+    retries = Retry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF_S,
+                    status_forcelist=RETRY_STATUSES)
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                          max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def make_http2_client(max_connections: int = POOL_MAXSIZE,
+                      max_keepalive: int = POOL_CONNECTIONS) -> Optional["httpx.Client"]:
+    """
+    httpx.Client speaking HTTP/2 where the provider negotiates it, or None
+
+    Concurrent requests from the provider's worker threads are multiplexed
+    over one TLS connection instead of one connection each. The client
+    answers get()/raise_for_status()/.content like a requests.Session, so
+    providers can use either. Returns None when httpx or its h2 extra is
+    not installed.
+    """
+    if httpx is None:
+        return None
+    try:
+        # Connection-level retries only; httpx has no status-based retry
+        transport = httpx.HTTPTransport(
+            http2=True, retries=RETRY_TOTAL,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive)
+        )
+        return httpx.Client(transport=transport, headers={'Accept-Encoding': 'gzip'})
+    except ImportError:  # http2=True needs the h2 package (httpx[http2])
+        return None
@@ -3,15 +3,129 @@ Traffic Data Integration
 Fetches live traffic speed data for congestion detection
 Supports multiple providers: Google Traffic API, HERE Traffic, TomTom Traffic
 """
-import requests
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Dict, Optional, List, Tuple
-from datetime import datetime, timedelta
+from datetime import datetime
 from dotenv import load_dotenv
+import orjson
 import random
 
+from backend.api_cache import ProviderCache, TRAFFIC_TTL_S, TRAFFIC_COORD_PRECISION, waypoints_key
+from backend.http_client import make_session
+from backend.geo import haversine_km, haversine_vec
+
 load_dotenv()
 
+# TomTom's synchronous batch endpoint accepts at most 100 items per request
+TOMTOM_BATCH_SIZE = 100
+
+
+# Mock traffic speed-ratio range by hour of day:
+# rush hour (7-9 AM, 5-7 PM) heavy, overnight (10 PM - 5 AM) free flow, otherwise moderate
+_HOUR_SPEED_RATIO_BOUNDS = tuple(
+    (0.5, 0.7) if (7 <= hour <= 9) or (17 <= hour <= 19)
+    else (0.9, 1.0) if (hour >= 22) or (hour <= 5)
+    else (0.7, 0.9)
+    for hour in range(24)
+)
+
+
+@lru_cache(maxsize=256)
+def _classify_and_explain(speed_pct: int) -> Tuple[str, str]:
+    """
+    Congestion level and explanation for a speed ratio in whole percent
+    
+    Only ~100 distinct inputs occur, so results (and their strings) are reused.
+    """
+    if speed_pct >= 90:
+        return 'none', "Free-flowing traffic conditions"
+    elif speed_pct >= 70:
+        return 'light', f"Light traffic conditions (speeds {speed_pct}% of normal)"
+    elif speed_pct >= 40:
+        return 'moderate', f"Moderate traffic delays (speeds {speed_pct}% of normal)"
+    else:
+        return 'heavy', f"Heavy traffic congestion (speeds {speed_pct}% of normal)"
+
+
+def _google_params(waypoints: List[Tuple[float, float]], api_key: str) -> Dict:
+    via_points = [f"{lat},{lon}" for lat, lon in waypoints[1:-1]]
+    return {
+        'origin': f"{waypoints[0][0]},{waypoints[0][1]}",
+        'destination': f"{waypoints[-1][0]},{waypoints[-1][1]}",
+        'waypoints': '|'.join(via_points) if via_points else None,
+        'departure_time': 'now',
+        'traffic_model': 'best_guess',
+        'key': api_key
+    }
+
+
+def _google_summary(data: Dict) -> Optional[Tuple[float, float, float]]:
+    if data.get('status') != 'OK' or not data.get('routes'):
+        return None
+    leg = data['routes'][0]['legs'][0]
+    return (leg['distance']['value'],
+            leg.get('duration_in_traffic', leg['duration'])['value'],
+            leg['duration']['value'])
+
+
+def _here_params(waypoints: List[Tuple[float, float]], api_key: str) -> Dict:
+    return {
+        'transportMode': 'truck',
+        'origin': f"{waypoints[0][0]},{waypoints[0][1]}",
+        'destination': f"{waypoints[-1][0]},{waypoints[-1][1]}",
+        'via': ';'.join(f"{lat},{lon}" for lat, lon in waypoints) if len(waypoints) > 2 else None,
+        'return': 'summary,polyline',
+        'apiKey': api_key,
+        'departureTime': datetime.utcnow().isoformat()
+    }
+
+
+def _here_summary(data: Dict) -> Optional[Tuple[float, float, float]]:
+    if not data.get('routes'):
+        return None
+    summary = data['routes'][0]['sections'][0]['summary']
+    return (summary['length'], summary['duration'],
+            summary.get('baseDuration', summary['duration']))
+
+
+def _tomtom_url(waypoints: List[Tuple[float, float]]) -> str:
+    locations = ':'.join(f"{lat},{lon}" for lat, lon in waypoints)
+    return f"https://api.tomtom.com/routing/1/calculateRoute/{locations}/json"
+
+
+def _tomtom_summary(summary: Dict) -> Tuple[float, float, float]:
+    return (summary['lengthInMeters'], summary['travelTimeInSeconds'],
+            summary.get('noTrafficTravelTimeInSeconds', summary['travelTimeInSeconds']))
+
+
+# Per-provider request shape and response extraction; every summary is
+# (distance_m, duration_current_s, duration_freeflow_s) or None when no route came back
+_TRAFFIC_PROVIDERS = {
+    'google': {
+        'label': 'Google',
+        'url': lambda waypoints: "https://maps.googleapis.com/maps/api/directions/json",
+        'params': _google_params,
+        'summary': _google_summary
+    },
+    'here': {
+        'label': 'HERE',
+        'url': lambda waypoints: "https://router.hereapi.com/v8/routes",
+        'params': _here_params,
+        'summary': _here_summary
+    },
+    'tomtom': {
+        'label': 'TomTom',
+        'url': _tomtom_url,
+        'params': lambda waypoints, api_key: {
+            'key': api_key, 'traffic': 'true', 'travelMode': 'truck', 'departAt': 'now'
+        },
+        'summary': lambda data: _tomtom_summary(data['routes'][0]['summary']) if data.get('routes') else None
+    }
+}
+
 
 class TrafficAPI:
     """Traffic data provider for ETA calculations and congestion detection"""
@@ -23,11 +137,21 @@ class TrafficAPI:
         self.tomtom_api_key = os.getenv('TOMTOM_API_KEY', '')
         
         # Cache to reduce API calls
-        self.cache = {}
-        self.cache_duration = timedelta(minutes=5)
+        self.cache = ProviderCache(maxsize=4096, ttl=TRAFFIC_TTL_S)
+        self.session = make_session(pool_connections=16, pool_maxsize=64)
+        self.executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='traffic')
+        # Mock provider's own generator, kept off the process-wide random state
+        self._mock_rng = random.Random()
         
-        # Determine which provider to use
+        # Determine which provider to use; bind its fetcher once (no caching inside)
         self.provider = self._select_provider()
+        self.api_key = {
+            'google': self.google_api_key,
+            'here': self.here_api_key,
+            'tomtom': self.tomtom_api_key
+        }.get(self.provider, '')
+        self._fetch_traffic = (self._get_mock_traffic if self.provider == 'mock'
+                               else self._get_provider_traffic)
         
     def _select_provider(self) -> str:
         """Select traffic data provider based on available API keys"""
@@ -56,213 +180,127 @@ class TrafficAPI:
             'travel_time_freeflow_s': int
         }
         """
-        # Check cache
-        cache_key = f"{waypoints[0][0]:.3f},{waypoints[0][1]:.3f}_{waypoints[-1][0]:.3f},{waypoints[-1][1]:.3f}"
-        if cache_key in self.cache:
-            cached_data, cached_time = self.cache[cache_key]
-            if datetime.utcnow() - cached_time < self.cache_duration:
-                return cached_data
+        # Check cache (keyed on every quantized waypoint, so via-points are part of the key)
+        cache_key = waypoints_key(waypoints, TRAFFIC_COORD_PRECISION)
+        cached_data = self.cache.get(cache_key)
+        if cached_data is not None:
+            return cached_data
         
-        # Fetch data based on provider
-        if self.provider == 'google':
-            traffic_data = self._get_google_traffic(waypoints)
-        elif self.provider == 'here':
-            traffic_data = self._get_here_traffic(waypoints)
-        elif self.provider == 'tomtom':
-            traffic_data = self._get_tomtom_traffic(waypoints)
-        else:
-            traffic_data = self._get_mock_traffic(waypoints)
+        traffic_data = self._fetch_traffic(waypoints)
         
         # Cache result
-        self.cache[cache_key] = (traffic_data, datetime.utcnow())
+        self.cache.set(cache_key, traffic_data)
         
         return traffic_data
     
-    def _get_google_traffic(self, waypoints: List[Tuple[float, float]]) -> Dict:
-        """Get traffic data from Google Maps Directions API"""
-        try:
-            # Build waypoints string
-            origin = f"{waypoints[0][0]},{waypoints[0][1]}"
-            destination = f"{waypoints[-1][0]},{waypoints[-1][1]}"
-            
-            # Add intermediate waypoints if any
-            via_points = []
-            if len(waypoints) > 2:
-                for i in range(1, len(waypoints) - 1):
-                    via_points.append(f"{waypoints[i][0]},{waypoints[i][1]}")
-            
-            url = "https://maps.googleapis.com/maps/api/directions/json"
-            params = {
-                'origin': origin,
-                'destination': destination,
-                'waypoints': '|'.join(via_points) if via_points else None,
-                'departure_time': 'now',
-                'traffic_model': 'best_guess',
-                'key': self.google_api_key
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if data['status'] == 'OK' and data['routes']:
-                route = data['routes'][0]
-                leg = route['legs'][0]
-                
-                # Calculate speeds
-                duration_in_traffic = leg.get('duration_in_traffic', leg['duration'])['value']
-                duration_normal = leg['duration']['value']
-                distance_m = leg['distance']['value']
-                
-                current_speed = (distance_m / duration_in_traffic) * 3.6  # m/s to km/h
-                freeflow_speed = (distance_m / duration_normal) * 3.6
-                
-                # Determine congestion level
-                speed_ratio = current_speed / freeflow_speed if freeflow_speed > 0 else 1.0
-                congestion = self._classify_congestion(speed_ratio)
-                
-                return {
-                    'average_speed_kph': current_speed,
-                    'freeflow_speed_kph': freeflow_speed,
-                    'congestion_level': congestion,
-                    'incidents': [],
-                    'travel_time_current_s': duration_in_traffic,
-                    'travel_time_freeflow_s': duration_normal,
-                    'speed_ratio': speed_ratio,
-                    'source': 'google'
-                }
-            
-        except Exception as e:
-            print(f"Google Traffic API error: {e}")
+    def get_traffic_on_routes(self, routes: List[List[Tuple[float, float]]]) -> List[Dict]:
+        """
+        Get traffic conditions for several routes, batching provider calls
         
-        return self._get_mock_traffic(waypoints)
+        Cached routes are served from memory. TomTom misses go out as batch
+        requests (up to TOMTOM_BATCH_SIZE routes per call); other providers
+        overlap their per-route calls on a thread pool. Results are in the
+        same order as routes.
+        """
+        keys = [waypoints_key(route, TRAFFIC_COORD_PRECISION) for route in routes]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+        
+        missing_routes = [routes[i] for i in missing]
+        if self.provider == 'tomtom':
+            fetched = []
+            for start in range(0, len(missing_routes), TOMTOM_BATCH_SIZE):
+                fetched += self._get_tomtom_traffic_batch(missing_routes[start:start + TOMTOM_BATCH_SIZE])
+        elif len(missing_routes) == 1:
+            fetched = [self._fetch_traffic(missing_routes[0])]
+        else:
+            fetched = list(self.executor.map(self._fetch_traffic, missing_routes))
+        
+        for i, traffic_data in zip(missing, fetched):
+            self.cache.set(keys[i], traffic_data)
+            results[i] = traffic_data
+        return results
     
-    def _get_here_traffic(self, waypoints: List[Tuple[float, float]]) -> Dict:
-        """Get traffic data from HERE Traffic API"""
+    def _get_provider_traffic(self, waypoints: List[Tuple[float, float]]) -> Dict:
+        """Get traffic data from the configured provider, falling back to mock data"""
+        spec = _TRAFFIC_PROVIDERS[self.provider]
         try:
-            # Build waypoints string
-            waypoint_str = ';'.join([f"{lat},{lon}" for lat, lon in waypoints])
-            
-            url = "https://router.hereapi.com/v8/routes"
-            params = {
-                'transportMode': 'truck',
-                'origin': f"{waypoints[0][0]},{waypoints[0][1]}",
-                'destination': f"{waypoints[-1][0]},{waypoints[-1][1]}",
-                'via': waypoint_str if len(waypoints) > 2 else None,
-                'return': 'summary,polyline',
-                'apiKey': self.here_api_key,
-                'departureTime': datetime.utcnow().isoformat()
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
+            response = self.session.get(spec['url'](waypoints),
+                                        params=spec['params'](waypoints, self.api_key),
+                                        timeout=10)
             response.raise_for_status()
             
-            data = response.json()
-            
-            if data.get('routes'):
-                route = data['routes'][0]
-                summary = route['sections'][0]['summary']
-                
-                duration_current = summary['duration']
-                duration_baseline = summary.get('baseDuration', duration_current)
-                distance_m = summary['length']
-                
-                current_speed = (distance_m / duration_current) * 3.6 if duration_current > 0 else 0
-                freeflow_speed = (distance_m / duration_baseline) * 3.6 if duration_baseline > 0 else current_speed
-                
-                speed_ratio = current_speed / freeflow_speed if freeflow_speed > 0 else 1.0
-                congestion = self._classify_congestion(speed_ratio)
-                
-                return {
-                    'average_speed_kph': current_speed,
-                    'freeflow_speed_kph': freeflow_speed,
-                    'congestion_level': congestion,
-                    'incidents': [],
-                    'travel_time_current_s': duration_current,
-                    'travel_time_freeflow_s': duration_baseline,
-                    'speed_ratio': speed_ratio,
-                    'source': 'here'
-                }
+            summary = spec['summary'](orjson.loads(response.content))
+            if summary:
+                return self._traffic_from_summary(*summary, source=self.provider)
             
         except Exception as e:
-            print(f"HERE Traffic API error: {e}")
+            print(f"{spec['label']} Traffic API error: {e}")
         
         return self._get_mock_traffic(waypoints)
     
-    def _get_tomtom_traffic(self, waypoints: List[Tuple[float, float]]) -> Dict:
-        """Get traffic data from TomTom Traffic API"""
+    def _get_tomtom_traffic_batch(self, routes: List[List[Tuple[float, float]]]) -> List[Dict]:
+        """Get traffic for up to TOMTOM_BATCH_SIZE routes with one TomTom batch request"""
+        results = [None] * len(routes)
         try:
-            # Build waypoints string
-            locations = ':'.join([f"{lat},{lon}" for lat, lon in waypoints])
-            
-            url = f"https://api.tomtom.com/routing/1/calculateRoute/{locations}/json"
-            params = {
-                'key': self.tomtom_api_key,
-                'traffic': 'true',
-                'travelMode': 'truck',
-                'departAt': 'now'
+            url = "https://api.tomtom.com/routing/1/batch/sync/json"
+            body = {
+                'batchItems': [
+                    {'query': "/calculateRoute/" + ':'.join(f"{lat},{lon}" for lat, lon in route)
+                              + "/json?traffic=true&travelMode=truck&departAt=now"}
+                    for route in routes
+                ]
             }
             
-            response = requests.get(url, params=params, timeout=10)
+            response = self.session.post(url, params={'key': self.tomtom_api_key}, json=body, timeout=30)
             response.raise_for_status()
             
-            data = response.json()
-            
-            if data.get('routes'):
-                route = data['routes'][0]
-                summary = route['summary']
-                
-                duration_traffic = summary['travelTimeInSeconds']
-                duration_notraffic = summary.get('noTrafficTravelTimeInSeconds', duration_traffic)
-                distance_m = summary['lengthInMeters']
-                
-                current_speed = (distance_m / duration_traffic) * 3.6 if duration_traffic > 0 else 0
-                freeflow_speed = (distance_m / duration_notraffic) * 3.6 if duration_notraffic > 0 else current_speed
-                
-                speed_ratio = current_speed / freeflow_speed if freeflow_speed > 0 else 1.0
-                congestion = self._classify_congestion(speed_ratio)
-                
-                return {
-                    'average_speed_kph': current_speed,
-                    'freeflow_speed_kph': freeflow_speed,
-                    'congestion_level': congestion,
-                    'incidents': [],
-                    'travel_time_current_s': duration_traffic,
-                    'travel_time_freeflow_s': duration_notraffic,
-                    'speed_ratio': speed_ratio,
-                    'source': 'tomtom'
-                }
+            for i, item in enumerate(orjson.loads(response.content).get('batchItems', [])[:len(routes)]):
+                item_routes = item.get('response', {}).get('routes')
+                if item.get('statusCode') == 200 and item_routes:
+                    results[i] = self._traffic_from_summary(*_tomtom_summary(item_routes[0]['summary']),
+                                                            source='tomtom')
             
         except Exception as e:
-            print(f"TomTom Traffic API error: {e}")
+            print(f"TomTom Traffic batch API error: {e}")
         
-        return self._get_mock_traffic(waypoints)
+        return [result if result is not None else self._get_mock_traffic(route)
+                for result, route in zip(results, routes)]
+    
+    def _traffic_from_summary(self, distance_m: float, duration_current: float,
+                              duration_freeflow: float, source: str) -> Dict:
+        """Convert a provider's route distance and travel times into the common traffic dict"""
+        current_speed = (distance_m / duration_current) * 3.6 if duration_current > 0 else 0  # m/s to km/h
+        freeflow_speed = (distance_m / duration_freeflow) * 3.6 if duration_freeflow > 0 else current_speed
+        
+        speed_ratio = current_speed / freeflow_speed if freeflow_speed > 0 else 1.0
+        congestion = self._classify_congestion(speed_ratio)
+        
+        return {
+            'average_speed_kph': current_speed,
+            'freeflow_speed_kph': freeflow_speed,
+            'congestion_level': congestion,
+            'incidents': [],
+            'travel_time_current_s': duration_current,
+            'travel_time_freeflow_s': duration_freeflow,
+            'speed_ratio': speed_ratio,
+            'source': source
+        }
     
     def _get_mock_traffic(self, waypoints: List[Tuple[float, float]]) -> Dict:
         """
         Generate mock traffic data for testing
         Simulates various traffic conditions based on time of day and location
         """
-        # Calculate approximate distance
-        distance_km = 0
-        for i in range(len(waypoints) - 1):
-            lat1, lon1 = waypoints[i]
-            lat2, lon2 = waypoints[i + 1]
-            distance_km += self._haversine_distance(lat1, lon1, lat2, lon2)
+        # Calculate approximate distance (all segments in one vectorized pass)
+        lats, lons = zip(*waypoints)
+        distance_km = float(haversine_vec(lats, lons).sum())
         
         # Simulate traffic based on time of day
-        hour = datetime.now().hour
-        
-        # Rush hour traffic (7-9 AM, 5-7 PM)
-        if (7 <= hour <= 9) or (17 <= hour <= 19):
-            speed_ratio = random.uniform(0.5, 0.7)  # Heavy traffic
-        # Light traffic (10 PM - 5 AM)
-        elif (22 <= hour) or (hour <= 5):
-            speed_ratio = random.uniform(0.9, 1.0)  # Free flow
-        # Normal traffic
-        else:
-            speed_ratio = random.uniform(0.7, 0.9)  # Moderate traffic
+        low, high = _HOUR_SPEED_RATIO_BOUNDS[datetime.now().hour]
+        speed_ratio = self._mock_rng.uniform(low, high)
         
         freeflow_speed = 80.0  # km/h
         current_speed = freeflow_speed * speed_ratio
@@ -290,30 +328,12 @@ class TrafficAPI:
         
         Spec: TRAFFIC_CONGESTION when live_speed/freeflow < 0.4
         """
-        if speed_ratio >= 0.9:
-            return 'none'
-        elif speed_ratio >= 0.7:
-            return 'light'
-        elif speed_ratio >= 0.4:
-            return 'moderate'
-        else:
-            return 'heavy'
+        return _classify_and_explain(int(speed_ratio * 100))[0]
     
     def _haversine_distance(self, lat1: float, lon1: float, 
                            lat2: float, lon2: float) -> float:
         """Calculate distance between two points in kilometers"""
-        from math import radians, sin, cos, sqrt, atan2
-        
-        R = 6371  # Earth's radius in km
-        
-        lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1-a))
-        
-        return R * c
+        return haversine_km(lat1, lon1, lat2, lon2)
     
     def calculate_traffic_multiplier(self, traffic_data: Dict) -> Tuple[float, str]:
         """
@@ -324,19 +344,10 @@ class TrafficAPI:
             reason: Human-readable explanation
         """
         speed_ratio = traffic_data.get('speed_ratio', 1.0)
-        congestion = traffic_data.get('congestion_level', 'none')
         
         # Use speed ratio as multiplier (capped at minimum 0.4 per spec)
         multiplier = max(speed_ratio, 0.4)
-        
-        if congestion == 'heavy':
-            reason = f"Heavy traffic congestion (speeds {int(speed_ratio * 100)}% of normal)"
-        elif congestion == 'moderate':
-            reason = f"Moderate traffic delays (speeds {int(speed_ratio * 100)}% of normal)"
-        elif congestion == 'light':
-            reason = f"Light traffic conditions (speeds {int(speed_ratio * 100)}% of normal)"
-        else:
-            reason = "Free-flowing traffic conditions"
+        _, reason = _classify_and_explain(int(speed_ratio * 100))
         
         return multiplier, reason
     
@@ -354,10 +365,13 @@ class TrafficAPI:
 
 # Singleton instance
 _traffic_instance = None
+_traffic_lock = threading.Lock()
 
 def get_traffic_api() -> TrafficAPI:
-    """Get singleton traffic API instance"""
+    """Get singleton traffic API instance (safe to call from any thread)"""
     global _traffic_instance
     if _traffic_instance is None:
-        _traffic_instance = TrafficAPI()
+        with _traffic_lock:
+            if _traffic_instance is None:
+                _traffic_instance = TrafficAPI()
     return _traffic_instance
@@ -2,16 +2,24 @@
 Valhalla-style Routing Client
 Uses OSRM backend with truck costing simulation until full Valhalla is set up
 """
+import os
 import requests
-import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from functools import lru_cache
 import math
+import threading
 
+from backend.api_cache import ProviderCache, ROUTE_TTL_S, ROUTE_FAILURE_TTL_S, quantize, waypoints_key
+from backend.http_client import make_session
+from backend.geo import decode_polyline as fast_decode_polyline, encode_polyline, simplify_path
 
-@dataclass
+
+@dataclass(frozen=True)
 class VehicleConstraints:
-    """Vehicle constraints for routing"""
+    """Vehicle constraints for routing (immutable, so usable directly in cache keys)"""
     height_m: float = 4.1
     width_m: float = 2.5
     weight_tons: float = 15.0
@@ -19,6 +27,110 @@ class VehicleConstraints:
     avoid_tolls: bool = False
 
 
+# osrm-routed rejects /match traces longer than --max-matching-size (default 100)
+OSRM_MATCH_MAX_POINTS = 100
+
+# Shared stand-in for missing nested objects in provider responses (never mutated)
+_EMPTY = {}
+
+# Shared default for callers that don't specify a vehicle
+DEFAULT_CONSTRAINTS = VehicleConstraints()
+
+# Fixed part of every Valhalla /route body; per-call fields are layered on top
+_VALHALLA_BODY_TEMPLATE = {
+    "directions_options": {
+        "units": "kilometers",
+        "language": "en-US"
+    },
+    "alternates": 2  # Request 2 alternative routes
+}
+
+
+@lru_cache(maxsize=64)
+def _valhalla_costing_options(constraints: VehicleConstraints) -> Dict:
+    """Valhalla costing_options for a vehicle (built once per distinct constraints; never mutated)"""
+    use_tolls = 0.0 if constraints.avoid_tolls else 1.0
+    return {
+        "truck": {
+            "height": constraints.height_m,
+            "width": constraints.width_m,
+            "weight": constraints.weight_tons,
+            "hazmat": constraints.hazmat_allowed,
+            "use_tolls": use_tolls
+        },
+        "auto": {
+            "use_tolls": use_tolls
+        }
+    }
+
+
+def _osrm_coords(points: List[Tuple[float, float]]) -> str:
+    """
+    OSRM "lon,lat;lon,lat" path string
+    
+    Fixed 6 decimals (~0.1 m) formats about twice as fast as float repr and
+    keeps long /match URLs ~40% shorter.
+    """
+    return ";".join(["%.6f,%.6f" % (lon, lat) for lat, lon in points])
+
+
+@lru_cache(maxsize=4096)
+def _osrm_coord(lat: float, lon: float) -> str:
+    """
+    Memoized "lon,lat" fragment for route waypoints
+    
+    Route requests keep starting from the same depots and stops, so their
+    fragments are formatted once. GPS traces (/match) are unique per fix
+    and go through _osrm_coords instead, so they don't churn this cache.
+    """
+    return "%.6f,%.6f" % (lon, lat)
+
+
+def decode_geometry(route: Dict) -> List[Tuple[float, float]]:
+    """
+    Materialize a route's geometry as (lat, lon) pairs
+    
+    Routes carry the provider's encoded polyline as-is; callers that only
+    need distance/duration never pay for decoding.
+    """
+    geometry = route.get('geometry')
+    if not geometry:
+        return []
+    if isinstance(geometry, dict):  # GeoJSON LineString
+        return [(lat, lon) for lon, lat in geometry['coordinates']]
+    precision = 5 if route.get('geometry_format') == 'polyline' else 6
+    try:
+        lats, lons = fast_decode_polyline(geometry, precision)
+    except ValueError as e:
+        print(f"Malformed route geometry: {e}")
+        return []
+    return list(zip(lats.tolist(), lons.tolist()))
+
+
+def simplify_geometry(route: Dict, tolerance_m: float = 5.0) -> Optional[str]:
+    """
+    Route geometry re-encoded with vertices closer than tolerance_m to the line removed
+    
+    Returns the encoded polyline in the route's own format, or None if the
+    provider's polyline is malformed; at map zoom <= 12 a 5 m tolerance is
+    visually lossless and drops most vertices.
+    """
+    geometry = route.get('geometry')
+    if not geometry:
+        return geometry
+    precision = 5 if route.get('geometry_format') == 'polyline' else 6
+    if isinstance(geometry, dict):  # GeoJSON LineString
+        lons, lats = zip(*geometry['coordinates'])
+    else:
+        try:
+            lats, lons = fast_decode_polyline(geometry, precision)
+        except ValueError as e:
+            print(f"Malformed route geometry: {e}")
+            return None
+    lats, lons = simplify_path(lats, lons, tolerance_m)
+    return encode_polyline(lats, lons, precision)
+
+
 class ValhallaRouter:
     """
     Valhalla-compatible routing client
@@ -28,10 +140,17 @@ class ValhallaRouter:
     def __init__(self, osrm_url: str = "https://router.project-osrm.org", valhalla_url: str = None):
         self.osrm_url = osrm_url
         self.valhalla_url = valhalla_url  # Set from environment variable
+        self.route_cache = ProviderCache(maxsize=10000, ttl=ROUTE_TTL_S)
+        self.route_failure_cache = ProviderCache(maxsize=2048, ttl=ROUTE_FAILURE_TTL_S)
+        # Sized for io_pool route fan-out plus the router's own alternatives/snap pool
+        self.session = make_session(pool_connections=32, pool_maxsize=64,
+                                    cache_name=os.getenv('ROUTER_HTTP_CACHE') or None)
+        self.executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='router')
         
     def route(self, waypoints: List[Tuple[float, float]], 
               constraints: VehicleConstraints = None,
-              costing: str = "truck") -> Dict:
+              costing: str = "truck", detailed: bool = True,
+              simplify_tolerance_m: Optional[float] = None) -> Dict:
         """
         Calculate route with truck costing
         
@@ -39,39 +158,82 @@ class ValhallaRouter:
             waypoints: List of (lat, lon) tuples
             constraints: Vehicle constraints
             costing: Routing profile (truck, auto, bicycle, pedestrian)
+            detailed: Include geometry and turn-by-turn; False fetches only
+                      distance/duration (OSRM skips overview and steps)
+            simplify_tolerance_m: If set, return a Douglas-Peucker simplified
+                      geometry (the cache keeps the full one)
             
         Returns:
             Dict with route geometry, distance, duration, and turn-by-turn
         """
-        if not constraints:
-            constraints = VehicleConstraints()
+        constraints = constraints or DEFAULT_CONSTRAINTS
         
+        cache_key = (waypoints_key(waypoints), constraints, costing, detailed)
+        cached = self.route_cache.get(cache_key)
+        if cached is None and not detailed:
+            # A detailed route answers a summary request too
+            cached = self.route_cache.get(cache_key[:3] + (True,))
+        if cached is None:
+            # Recent failure for the same request (detail level doesn't change the outcome)
+            cached = self.route_failure_cache.get(cache_key[:3])
+        if cached is not None:
+            # Shallow copy so callers can adjust durations without touching the cached route
+            result = dict(cached)
+        else:
+            result = self._route_uncached(waypoints, constraints, costing, detailed)
+            if result.get('success'):
+                self.route_cache.set(cache_key, dict(result))
+            else:
+                self.route_failure_cache.set(cache_key[:3], dict(result))
+        
+        if simplify_tolerance_m and result.get('geometry'):
+            result['geometry'] = simplify_geometry(result, simplify_tolerance_m)
+            if result.get('geometry_format') != 'polyline':
+                result['geometry_format'] = 'polyline6'
+        return result
+    
+    def _route_uncached(self, waypoints: List[Tuple[float, float]], constraints: VehicleConstraints,
+                        costing: str, detailed: bool) -> Dict:
+        """Fetch a route from the configured engine, bypassing the route cache"""
         # If Valhalla server available, use it
         if self.valhalla_url:
             return self._valhalla_route(waypoints, constraints, costing)
-        
         # Otherwise use OSRM with truck profile
-        return self._osrm_route(waypoints, constraints)
+        return self._osrm_route(waypoints, constraints,
+                                overview='full' if detailed else 'false',
+                                with_steps=detailed)
+    
+    def cache_clear(self) -> None:
+        """Drop all memoized routes and remembered failures"""
+        self.route_cache.clear()
+        self.route_failure_cache.clear()
     
     def _osrm_route(self, waypoints: List[Tuple[float, float]], 
-                    constraints: VehicleConstraints) -> Dict:
-        """Route using OSRM"""
+                    constraints: VehicleConstraints, overview: str = 'full',
+                    with_steps: bool = True, with_annotations: bool = False) -> Dict:
+        """
+        Route using OSRM
+        
+        overview: 'full', 'simplified' (server-side generalized) or 'false' (no geometry)
+        with_steps / with_annotations: include turn-by-turn / per-edge arrays
+        """
         try:
             # Build coordinates string (lon,lat format for OSRM)
-            coords = ";".join([f"{lon},{lat}" for lat, lon in waypoints])
+            coords = ";".join([_osrm_coord(lat, lon) for lat, lon in waypoints])
             
             url = f"{self.osrm_url}/route/v1/driving/{coords}"
             params = {
-                'overview': 'full',
-                'geometries': 'geojson',
-                'steps': 'true',
-                'annotations': 'true'
+                'overview': overview,
+                'geometries': 'polyline6',
+                'steps': 'true' if with_steps else 'false'
             }
+            if with_annotations:
+                params['annotations'] = 'true'
             
-            response = requests.get(url, params=params, timeout=10)
+            response = self.session.get(url, params=params, timeout=10)
             response.raise_for_status()
             
-            data = response.json()
+            data = orjson.loads(response.content)
             
             if data.get('code') != 'Ok' or not data.get('routes'):
                 raise Exception(f"OSRM routing failed: {data.get('code')}")
@@ -79,18 +241,19 @@ class ValhallaRouter:
             route = data['routes'][0]
             
             # Extract turn-by-turn instructions
-            instructions = []
-            for leg in route.get('legs', []):
-                for step in leg.get('steps', []):
-                    instructions.append({
-                        'instruction': step.get('maneuver', {}).get('instruction', ''),
-                        'distance_m': step.get('distance', 0),
-                        'duration_s': step.get('duration', 0)
-                    })
+            instructions = [
+                {
+                    'instruction': (step.get('maneuver') or _EMPTY).get('instruction', ''),
+                    'distance_m': step.get('distance', 0),
+                    'duration_s': step.get('duration', 0)
+                }
+                for leg in route.get('legs', ()) for step in leg.get('steps', ())
+            ]
             
             return {
                 'success': True,
-                'geometry': route['geometry'],  # GeoJSON
+                'geometry': route.get('geometry'),  # Encoded polyline; see decode_geometry()
+                'geometry_format': 'polyline6',
                 'distance_km': route['distance'] / 1000,
                 'duration_min': route['duration'] / 60,
                 'distance_m': route['distance'],
@@ -112,54 +275,39 @@ class ValhallaRouter:
                        constraints: VehicleConstraints, costing: str) -> Dict:
         """Route using Valhalla with full truck costing support"""
         try:
-            # Build Valhalla request
-            locations = [{"lat": lat, "lon": lon} for lat, lon in waypoints]
-            
-            request_body = {
-                "locations": locations,
-                "costing": costing,
-                "costing_options": {
-                    "truck": {
-                        "height": constraints.height_m,
-                        "width": constraints.width_m,
-                        "weight": constraints.weight_tons,
-                        "hazmat": constraints.hazmat_allowed,
-                        "use_tolls": 0.0 if constraints.avoid_tolls else 1.0
-                    },
-                    "auto": {
-                        "use_tolls": 0.0 if constraints.avoid_tolls else 1.0
-                    }
-                },
-                "directions_options": {
-                    "units": "kilometers",
-                    "language": "en-US"
-                },
-                "alternates": 2  # Request 2 alternative routes
-            }
+            # Build Valhalla request: shallow copy of the template, only
+            # locations/costing vary per call
+            request_body = dict(
+                _VALHALLA_BODY_TEMPLATE,
+                locations=[{"lat": lat, "lon": lon} for lat, lon in waypoints],
+                costing=costing,
+                costing_options=_valhalla_costing_options(constraints)
+            )
             
-            response = requests.post(
+            response = self.session.post(
                 f"{self.valhalla_url}/route",
-                json=request_body,
+                data=orjson.dumps(request_body),
                 timeout=15,
                 headers={'Content-Type': 'application/json'}
             )
             response.raise_for_status()
             
-            data = response.json()
+            data = orjson.loads(response.content)
             
             # Parse Valhalla response
             trip = data['trip']
             leg = trip['legs'][0]
             
             # Parse maneuvers into instructions
-            instructions = []
-            for maneuver in leg.get('maneuvers', []):
-                instructions.append({
+            instructions = [
+                {
                     'instruction': maneuver.get('instruction', ''),
                     'distance_m': maneuver.get('length', 0) * 1000,
                     'duration_s': maneuver.get('time', 0),
                     'street_names': maneuver.get('street_names', [])
-                })
+                }
+                for maneuver in leg.get('maneuvers', ())
+            ]
             
             # Parse alternative routes if available
             alternatives = []
@@ -169,12 +317,14 @@ class ValhallaRouter:
                     alternatives.append({
                         'distance_km': alt_trip['summary']['length'],
                         'duration_min': alt_trip['summary']['time'] / 60,
-                        'geometry': alt_trip['legs'][0]['shape']
+                        'geometry': alt_trip['legs'][0]['shape'],
+                        'geometry_format': 'polyline6'
                     })
             
             return {
                 'success': True,
-                'geometry': leg['shape'],  # Encoded polyline
+                'geometry': leg['shape'],  # Encoded polyline; see decode_geometry()
+                'geometry_format': 'polyline6',
                 'distance_km': trip['summary']['length'],
                 'duration_min': trip['summary']['time'] / 60,
                 'distance_m': trip['summary']['length'] * 1000,
@@ -208,10 +358,10 @@ class ValhallaRouter:
         """
         try:
             url = f"{self.osrm_url}/nearest/v1/driving/{lon},{lat}"
-            response = requests.get(url, timeout=5)
+            response = self.session.get(url, timeout=5)
             response.raise_for_status()
             
-            data = response.json()
+            data = orjson.loads(response.content)
             
             if data.get('code') == 'Ok' and data.get('waypoints'):
                 waypoint = data['waypoints'][0]
@@ -224,6 +374,61 @@ class ValhallaRouter:
         # Return original coordinates if snapping fails
         return lat, lon
     
+    def _match_trace(self, points: List[Tuple[float, float]]) -> List[Optional[Tuple[float, float]]]:
+        """Map-match one trace window; None for points the matcher could not place"""
+        snapped = [None] * len(points)
+        if len(points) < 2:
+            return snapped
+        
+        try:
+            coords = _osrm_coords(points)
+            url = f"{self.osrm_url}/match/v1/driving/{coords}"
+            response = self.session.get(url, params={'overview': 'false'}, timeout=10)
+            response.raise_for_status()
+            
+            data = orjson.loads(response.content)
+            
+            if data.get('code') == 'Ok':
+                for i, tracepoint in enumerate(data.get('tracepoints') or []):
+                    if tracepoint:
+                        location = tracepoint['location']
+                        snapped[i] = (location[1], location[0])  # lat, lon
+            
+        except Exception as e:
+            print(f"Batch snap-to-road failed: {e}")
+        
+        return snapped
+    
+    def snap_to_road_batch(self, points: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+        """
+        Snap a batch of GPS points to the road network
+        
+        Uses OSRM map matching, splitting long traces into windows of
+        OSRM_MATCH_MAX_POINTS matched concurrently; points the matcher
+        could not place are snapped individually (in parallel) instead.
+        
+        Returns: List of (snapped_lat, snapped_lon) in input order
+        """
+        if len(points) < 2:
+            return [self.snap_to_road(lat, lon) for lat, lon in points]
+        
+        windows = [points[start:start + OSRM_MATCH_MAX_POINTS]
+                   for start in range(0, len(points), OSRM_MATCH_MAX_POINTS)]
+        if len(windows) == 1:
+            snapped = self._match_trace(points)
+        else:
+            snapped = [point for window in self.executor.map(self._match_trace, windows)
+                       for point in window]
+        
+        # Fall back to per-point snapping for anything the matcher dropped
+        missing = [i for i, point in enumerate(snapped) if point is None]
+        if missing:
+            results = self.executor.map(lambda i: self.snap_to_road(*points[i]), missing)
+            for i, point in zip(missing, results):
+                snapped[i] = point
+        
+        return snapped
+    
     def compare_routes(self, waypoints: List[Tuple[float, float]],
                       constraints: VehicleConstraints,
                       alternatives: int = 2) -> List[Dict]:
@@ -265,11 +470,20 @@ class ValhallaRouter:
         Returns:
             List of route options with reasoning
         """
-        if not constraints:
-            constraints = VehicleConstraints()
+        constraints = constraints or DEFAULT_CONSTRAINTS
         
         alternatives = []
         
+        constraints_no_toll = None if constraints.avoid_tolls else replace(constraints, avoid_tolls=True)
+        
+        # OSRM never returns alternates, so the fallback routes below are always
+        # needed; request them concurrently with the primary route
+        auto_future = no_toll_future = None
+        if not self.valhalla_url and num_alternatives > 1:
+            auto_future = self.executor.submit(self.route, waypoints, constraints, "auto")
+            if constraints_no_toll:
+                no_toll_future = self.executor.submit(self.route, waypoints, constraints_no_toll, "truck")
+        
         # Route 1: Fastest (default truck routing)
         route1 = self.route(waypoints, constraints, costing="truck")
         if route1['success']:
@@ -312,11 +526,17 @@ class ValhallaRouter:
                     'geometry': alt['geometry']
                 })
         else:
+            # Valhalla returned no alternates: issue both fallback routes together
+            if auto_future is None and num_alternatives > 1:
+                auto_future = self.executor.submit(self.route, waypoints, constraints, "auto")
+                if constraints_no_toll:
+                    no_toll_future = self.executor.submit(self.route, waypoints, constraints_no_toll, "truck")
+            
             # Fallback: Calculate shortest distance route
             if len(alternatives) < num_alternatives:
                 # For shortest, we'd need to request with different preferences
                 # This is a placeholder for demonstration
-                route2 = self.route(waypoints, constraints, costing="auto")
+                route2 = auto_future.result() if auto_future else self.route(waypoints, constraints, costing="auto")
                 if route2['success'] and route2['distance_km'] < route1['distance_km'] * 0.95:
                     dist_saved = route1['distance_km'] - route2['distance_km']
                     alternatives.append({
@@ -330,15 +550,9 @@ class ValhallaRouter:
                     })
             
             # Route 3: Avoid tolls if not already avoiding
-            if len(alternatives) < num_alternatives and not constraints.avoid_tolls:
-                constraints_no_toll = VehicleConstraints(
-                    avoid_tolls=True,
-                    height_m=constraints.height_m,
-                    width_m=constraints.width_m,
-                    weight_tons=constraints.weight_tons,
-                    hazmat_allowed=constraints.hazmat_allowed
-                )
-                route3 = self.route(waypoints, constraints_no_toll, costing="truck")
+            if len(alternatives) < num_alternatives and constraints_no_toll:
+                route3 = (no_toll_future.result() if no_toll_future
+                          else self.route(waypoints, constraints_no_toll, costing="truck"))
                 if route3['success']:
                     time_diff = route3['duration_min'] - route1['duration_min']
                     alternatives.append({
@@ -369,7 +583,7 @@ class ValhallaRouter:
         Returns:
             Route with adjusted ETA
         """
-        route = self.route(waypoints, constraints)
+        route = self.route(waypoints, constraints, detailed=False)
         
         if not route.get('success'):
             return route
@@ -395,21 +609,44 @@ class ValhallaRouter:
         return route
 
 
-# Singleton instance
-_router_instance = None
+# One router per (osrm_url, valhalla_url) backend pair
+_router_instances: Dict[Tuple[str, Optional[str]], ValhallaRouter] = {}
+_router_instances_lock = threading.Lock()
 
 def get_router(valhalla_url: str = None, osrm_url: str = "https://router.project-osrm.org") -> ValhallaRouter:
     """
-    Get singleton router instance
+    Get the shared router instance for a backend
     
     Args:
         valhalla_url: URL of Valhalla server (e.g., http://localhost:8002)
         osrm_url: URL of OSRM server (fallback)
         
     Returns:
-        ValhallaRouter instance
+        ValhallaRouter instance (one per distinct URL pair)
+    """
+    key = (osrm_url, valhalla_url)
+    with _router_instances_lock:
+        router = _router_instances.get(key)
+        if router is None:
+            router = _router_instances[key] = ValhallaRouter(osrm_url=osrm_url, valhalla_url=valhalla_url)
+    return router
+
+
+class RouterPool:
     """
-    global _router_instance
-    if _router_instance is None:
-        _router_instance = ValhallaRouter(osrm_url=osrm_url, valhalla_url=valhalla_url)
-    return _router_instance
+    Shards routing across several Valhalla replicas
+    
+    Each request is pinned to a replica by its (quantized) origin, so
+    repeat requests from the same depot/vehicle land on the same router
+    and reuse that router's route cache.
+    """
+    
+    def __init__(self, valhalla_urls: List[str], osrm_url: str = "https://router.project-osrm.org"):
+        if not valhalla_urls:
+            raise ValueError("RouterPool needs at least one Valhalla URL")
+        self.routers = [get_router(valhalla_url=url, osrm_url=osrm_url) for url in valhalla_urls]
+    
+    def for_waypoints(self, waypoints: List[Tuple[float, float]]) -> ValhallaRouter:
+        """Router responsible for a route starting at waypoints[0]"""
+        lat, lon = waypoints[0]
+        return self.routers[hash(quantize(lat, lon)) % len(self.routers)]
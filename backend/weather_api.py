@@ -3,23 +3,138 @@ Weather API Integration
 Fetches weather data for delay reason scoring
 Uses OpenWeatherMap API (free tier)
 """
-import requests
+import atexit
 import os
-from typing import Dict, Optional, Tuple
-from datetime import datetime, timedelta
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 
+from backend.api_cache import CACHE_DISABLED, ProviderCache, SingleFlight, WEATHER_TTL_S
+from backend.http_client import make_http2_client, make_session
+
+try:
+    import diskcache
+except ImportError:  # diskcache is optional; without it weather is cached in memory only
+    diskcache = None
+
 load_dotenv()
 
+# 'openweather' (needs OPENWEATHER_API_KEY) or 'openmeteo' (keyless, batches many points per request)
+WEATHER_PROVIDER = os.getenv('WEATHER_PROVIDER', 'openweather').lower()
+
+# Set WEATHER_HTTP2=1 to multiplex weather calls over HTTP/2 (needs httpx[http2])
+WEATHER_HTTP2 = os.getenv('WEATHER_HTTP2', '').lower() in ('1', 'true', 'yes')
+
+# Weather is cached per grid cell; 0.05 deg ~ 5 km, well below the scale weather varies on
+WEATHER_CACHE_GRID_DEG = float(os.getenv('WEATHER_CACHE_GRID_DEG', '0.05'))
+
+OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
+
+# WMO weather interpretation codes (Open-Meteo weather_code) -> OpenWeather-style condition
+_WMO_CONDITIONS = (
+    ((0,), 'Clear'),
+    ((1, 2, 3), 'Clouds'),
+    ((45, 48), 'Fog'),
+    ((51, 53, 55, 56, 57), 'Drizzle'),
+    ((61, 63, 65, 66, 67, 80, 81, 82), 'Rain'),
+    ((71, 73, 75, 77, 85, 86), 'Snow'),
+    ((95, 96, 99), 'Thunderstorm'),
+)
+_WMO_CONDITION_BY_CODE = {code: label for codes, label in _WMO_CONDITIONS for code in codes}
+
+# Optional on-disk second-level cache so warm weather survives restarts (needs diskcache)
+WEATHER_DISK_CACHE_DIR = os.getenv('WEATHER_DISK_CACHE_DIR') or None
+WEATHER_DISK_CACHE_BYTES = 64 * 1024 * 1024
+
+# Mock weather (no API key) is drawn in blocks from one NumPy generator;
+# set MOCK_WEATHER_SEED for a reproducible sequence
+MOCK_WEATHER_SEED = os.getenv('MOCK_WEATHER_SEED')
+MOCK_WEATHER_BLOCK = 4096
+_MOCK_CONDITIONS = ('Clear', 'Clouds', 'Rain', 'Drizzle')
+_MOCK_CONDITION_WEIGHTS = (0.5, 0.3, 0.15, 0.05)
+
+# Band tables for the vectorized scorer, mirroring calculate_weather_multiplier's
+# elif chain: ascending thresholds, and the multiplier for each band index
+# (0 = at or below every threshold). Precipitation takes precedence over wind.
+_PRECIP_THRESHOLDS = np.array([0.0, 5.0, 10.0])
+_PRECIP_MULTIPLIERS = np.array([1.0, 0.9, 0.8, 0.6])
+_WIND_THRESHOLDS = np.array([30.0, 40.0])
+_WIND_MULTIPLIERS = np.array([1.0, 0.85, 0.7])
+
+# Active weather alerts cap the multiplier
+ALERT_MULTIPLIER_CAP = 0.7
+
+# Lowest multiplier calculate_weather_multiplier can return (heavy rain)
+WEATHER_MULTIPLIER_FLOOR = float(min(_PRECIP_MULTIPLIERS.min(), _WIND_MULTIPLIERS.min()))
+
+# Below this many samples the plain Python scan beats NumPy's array setup cost
+WEATHER_VECTORIZE_MIN_SAMPLES = 128
+
+
+def weather_cell(lat: float, lon: float, step: float = WEATHER_CACHE_GRID_DEG) -> Tuple[float, float]:
+    """Center of the grid cell containing (lat, lon); nearby route samples share one cache entry"""
+    return (round(round(lat / step) * step, 6), round(round(lon / step) * step, 6))
+
+
+@dataclass
+class WeatherImpact:
+    """Worst weather condition along a route, with the readings behind it"""
+    label: str
+    precip_mm_h: float = 0.0
+    wind_kmh: float = 0.0
+    
+    def __str__(self) -> str:
+        return self.label
+
 
 class WeatherAPI:
     """Weather data provider for ETA calculations"""
     
     def __init__(self):
         self.api_key = os.getenv('OPENWEATHER_API_KEY', '')
+        self.provider = WEATHER_PROVIDER
+        # Cleared on the first 401 from One Call (key limited to /weather)
+        self.onecall_available = True
         self.base_url = "https://api.openweathermap.org/data/2.5"
-        self.cache = {}  # Simple in-memory cache
-        self.cache_duration = timedelta(minutes=10)
+        self.cache = ProviderCache(maxsize=4096, ttl=WEATHER_TTL_S)
+        self.disk_cache = None
+        if WEATHER_DISK_CACHE_DIR and diskcache is not None and not CACHE_DISABLED:
+            self.disk_cache = diskcache.Cache(WEATHER_DISK_CACHE_DIR, size_limit=WEATHER_DISK_CACHE_BYTES)
+        # Concurrent misses on one cell share a single provider call
+        self._inflight = SingleFlight()
+        self.session = (make_http2_client() if WEATHER_HTTP2 else None) or make_session()
+        self._mock_rng = np.random.default_rng(int(MOCK_WEATHER_SEED) if MOCK_WEATHER_SEED else None)
+        self._mock_rows = iter(())
+        self._mock_lock = threading.Lock()
+        # Fans out per-point lookups for providers without a batch endpoint
+        self.executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='weather')
+        
+    def close(self) -> None:
+        """Close pooled keep-alive connections to the weather provider"""
+        self.executor.shutdown(wait=False)
+        self.session.close()
+        if self.disk_cache is not None:
+            self.disk_cache.close()
+    
+    def _cache_get(self, key: Tuple[float, float]) -> Optional[Dict]:
+        """Memory cache first, then the disk cache (promoting disk hits into memory)"""
+        weather = self.cache.get(key)
+        if weather is None and self.disk_cache is not None:
+            weather = self.disk_cache.get(key)
+            if weather is not None:
+                self.cache.set(key, weather)
+        return weather
+    
+    def _cache_set(self, key: Tuple[float, float], weather: Dict) -> None:
+        """Store in memory and, when configured, on disk with the same TTL"""
+        self.cache.set(key, weather)
+        if self.disk_cache is not None:
+            self.disk_cache.set(key, weather, expire=WEATHER_TTL_S)
         
     def get_weather(self, lat: float, lon: float) -> Optional[Dict]:
         """
@@ -33,48 +148,36 @@ class WeatherAPI:
             'alerts': []
         }
         """
+        if self.provider == 'openmeteo':
+            return self.get_weather_batch([(lat, lon)])[0]
+        
         if not self.api_key:
             return self._mock_weather_data(lat, lon)
         
         # Check cache
-        cache_key = f"{lat:.3f},{lon:.3f}"
-        if cache_key in self.cache:
-            cached_data, cached_time = self.cache[cache_key]
-            if datetime.utcnow() - cached_time < self.cache_duration:
-                return cached_data
+        cache_key = weather_cell(lat, lon)
+        cached_data = self._cache_get(cache_key)
+        if cached_data is not None:
+            return cached_data
+        
+        return self._inflight.do(cache_key, lambda: self._fetch_openweather(lat, lon, cache_key))
+    
+    def _fetch_openweather(self, lat: float, lon: float, cache_key: Tuple[float, float]) -> Dict:
+        """Fetch and cache current OpenWeather conditions (mock data on failure)"""
+        # A call that finished just before this one took the lead may have filled the cache
+        cached_data = self._cache_get(cache_key)
+        if cached_data is not None:
+            return cached_data
         
         try:
-            # Get current weather
-            url = f"{self.base_url}/weather"
-            params = {
-                'lat': lat,
-                'lon': lon,
-                'appid': self.api_key,
-                'units': 'metric'
-            }
-            
-            response = requests.get(url, params=params, timeout=5)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # Parse response
-            weather_data = {
-                'precipitation_mm_h': self._get_precipitation(data),
-                'wind_speed_kph': data['wind']['speed'] * 3.6,  # m/s to km/h
-                'temperature_c': data['main']['temp'],
-                'conditions': data['weather'][0]['main'],
-                'description': data['weather'][0]['description'],
-                'alerts': []
-            }
-            
-            # Get weather alerts if available
-            alerts = self._get_alerts(lat, lon)
-            if alerts:
-                weather_data['alerts'] = alerts
+            # One Call returns current conditions and alerts together; keys
+            # without One Call access fall back to the current-weather endpoint
+            weather_data = self._fetch_onecall(lat, lon) if self.onecall_available else None
+            if weather_data is None:
+                weather_data = self._fetch_current(lat, lon)
             
             # Cache result
-            self.cache[cache_key] = (weather_data, datetime.utcnow())
+            self._cache_set(cache_key, weather_data)
             
             return weather_data
             
@@ -82,85 +185,173 @@ class WeatherAPI:
             print(f"Weather API error: {e}")
             return self._mock_weather_data(lat, lon)
     
-    def _get_precipitation(self, data: Dict) -> float:
-        """Extract precipitation rate in mm/h"""
-        # Check for rain
-        if 'rain' in data and '1h' in data['rain']:
-            return data['rain']['1h']
+    def _fetch_onecall(self, lat: float, lon: float) -> Optional[Dict]:
+        """Current conditions plus alerts in one request; None if the key lacks One Call access"""
+        url = f"{self.base_url}/onecall"
+        params = {
+            'lat': lat,
+            'lon': lon,
+            'appid': self.api_key,
+            'exclude': 'minutely,hourly,daily',
+            'units': 'metric'
+        }
         
-        # Check for snow (convert to rain equivalent)
-        if 'snow' in data and '1h' in data['snow']:
-            return data['snow']['1h'] * 0.1  # Rough conversion
+        response = self.session.get(url, params=params, timeout=5)
+        if response.status_code == 401:
+            # Remember the downgrade so later lookups go straight to /weather
+            self.onecall_available = False
+            return None
+        response.raise_for_status()
         
-        return 0.0
+        data = orjson.loads(response.content)
+        current = data['current']
+        
+        return {
+            'precipitation_mm_h': self._get_precipitation(current),
+            'wind_speed_kph': current['wind_speed'] * 3.6,  # m/s to km/h
+            'temperature_c': current['temp'],
+            'conditions': current['weather'][0]['main'],
+            'description': current['weather'][0]['description'],
+            'alerts': [
+                {
+                    'event': alert['event'],
+                    'description': alert['description'],
+                    'start': alert['start'],
+                    'end': alert['end']
+                }
+                for alert in data.get('alerts', ())
+            ]
+        }
     
-    def _get_alerts(self, lat: float, lon: float) -> list:
-        """Get weather alerts for location"""
-        if not self.api_key:
-            return []
+    def _fetch_current(self, lat: float, lon: float) -> Dict:
+        """Current conditions from the /weather endpoint (no alerts)"""
+        url = f"{self.base_url}/weather"
+        params = {
+            'lat': lat,
+            'lon': lon,
+            'appid': self.api_key,
+            'units': 'metric'
+        }
+        
+        response = self.session.get(url, params=params, timeout=5)
+        response.raise_for_status()
+        
+        data = orjson.loads(response.content)
+        
+        return {
+            'precipitation_mm_h': self._get_precipitation(data),
+            'wind_speed_kph': data['wind']['speed'] * 3.6,  # m/s to km/h
+            'temperature_c': data['main']['temp'],
+            'conditions': data['weather'][0]['main'],
+            'description': data['weather'][0]['description'],
+            'alerts': []
+        }
+    
+    def get_weather_batch(self, points: List[Tuple[float, float]]) -> List[Optional[Dict]]:
+        """
+        Current weather for several (lat, lon) points, in input order
+        
+        Open-Meteo answers all uncached points with one request; other
+        providers fall back to concurrent per-point get_weather calls.
+        """
+        if self.provider != 'openmeteo':
+            return list(self.executor.map(lambda point: self.get_weather(*point), points))
+        
+        keys = [weather_cell(lat, lon) for lat, lon in points]
+        results = [self._cache_get(key) for key in keys]
+        # One request per distinct uncached cell
+        missing = list(dict.fromkeys(key for key, weather in zip(keys, results) if weather is None))
+        if not missing:
+            return results
         
+        fetched = self._fetch_open_meteo(missing)
+        for key, weather in fetched.items():
+            self._cache_set(key, weather)
+        return [
+            weather if weather is not None else fetched.get(key) or self._mock_weather_data(*key)
+            for key, weather in zip(keys, results)
+        ]
+    
+    def _fetch_open_meteo(self, cells: List[Tuple[float, float]]) -> Dict[Tuple[float, float], Dict]:
+        """Current conditions for many cells in one Open-Meteo call (empty dict on failure)"""
         try:
-            url = f"{self.base_url}/onecall"
             params = {
-                'lat': lat,
-                'lon': lon,
-                'appid': self.api_key,
-                'exclude': 'minutely,hourly,daily',
-                'units': 'metric'
+                'latitude': ','.join(str(lat) for lat, _ in cells),
+                'longitude': ','.join(str(lon) for _, lon in cells),
+                'current': 'precipitation,wind_speed_10m,temperature_2m,weather_code',
+                'wind_speed_unit': 'kmh'
             }
-            
-            response = requests.get(url, params=params, timeout=5)
+            response = self.session.get(OPEN_METEO_URL, params=params, timeout=5)
             response.raise_for_status()
             
-            data = response.json()
+            data = orjson.loads(response.content)
+            # A single location comes back as an object, several as a list
+            locations = data if isinstance(data, list) else [data]
             
-            if 'alerts' in data:
-                return [
-                    {
-                        'event': alert['event'],
-                        'description': alert['description'],
-                        'start': alert['start'],
-                        'end': alert['end']
-                    }
-                    for alert in data['alerts']
-                ]
+            weather_by_cell = {}
+            for cell, location in zip(cells, locations):
+                current = location['current']
+                condition = _WMO_CONDITION_BY_CODE.get(current.get('weather_code'), 'Clear')
+                weather_by_cell[cell] = {
+                    'precipitation_mm_h': current.get('precipitation') or 0.0,
+                    'wind_speed_kph': current.get('wind_speed_10m') or 0.0,
+                    'temperature_c': current.get('temperature_2m'),
+                    'conditions': condition,
+                    'description': condition.lower(),
+                    'alerts': []
+                }
+            return weather_by_cell
             
         except Exception as e:
-            print(f"Weather alerts error: {e}")
+            print(f"Open-Meteo API error: {e}")
+            return {}
+    
+    def _get_precipitation(self, data: Dict) -> float:
+        """Extract precipitation rate in mm/h (from /weather data or One Call 'current')"""
+        # Check for rain
+        if 'rain' in data and '1h' in data['rain']:
+            return data['rain']['1h']
+        
+        # Check for snow (convert to rain equivalent)
+        if 'snow' in data and '1h' in data['snow']:
+            return data['snow']['1h'] * 0.1  # Rough conversion
         
-        return []
+        return 0.0
     
     def _mock_weather_data(self, lat: float, lon: float) -> Dict:
         """
         Mock weather data for testing without API key
-        Simulates various conditions based on location
+        Random conditions: mostly clear/cloudy, occasional rain or drizzle
         """
-        # Simulate different conditions for different areas
-        import random
-        
-        # Base conditions
-        conditions = ['Clear', 'Clouds', 'Rain', 'Drizzle']
-        weights = [0.5, 0.3, 0.15, 0.05]
-        
-        condition = random.choices(conditions, weights=weights)[0]
-        
-        if condition == 'Rain':
-            precip = random.uniform(5, 15)
-        elif condition == 'Drizzle':
-            precip = random.uniform(1, 5)
-        else:
-            precip = 0.0
+        with self._mock_lock:
+            row = next(self._mock_rows, None)
+            if row is None:
+                self._mock_rows = self._mock_weather_block()
+                row = next(self._mock_rows)
+        condition, precip, wind, temp = row
         
         return {
             'precipitation_mm_h': precip,
-            'wind_speed_kph': random.uniform(5, 25),
-            'temperature_c': random.uniform(15, 30),
+            'wind_speed_kph': wind,
+            'temperature_c': temp,
             'conditions': condition,
             'description': condition.lower(),
             'alerts': [],
             'mock': True
         }
     
+    def _mock_weather_block(self):
+        """Draw MOCK_WEATHER_BLOCK mock readings at once; yields (condition, precip, wind, temp)"""
+        rng, size = self._mock_rng, MOCK_WEATHER_BLOCK
+        kind = rng.choice(len(_MOCK_CONDITIONS), size=size, p=_MOCK_CONDITION_WEIGHTS)
+        # Rain 5-15 mm/h, drizzle 1-5 mm/h, otherwise dry
+        precip = np.select([kind == 2, kind == 3],
+                           [rng.uniform(5, 15, size), rng.uniform(1, 5, size)], default=0.0)
+        wind = rng.uniform(5, 25, size)
+        temp = rng.uniform(15, 30, size)
+        conditions = [_MOCK_CONDITIONS[k] for k in kind.tolist()]
+        return zip(conditions, precip.tolist(), wind.tolist(), temp.tolist())
+    
     def calculate_weather_multiplier(self, weather: Dict) -> Tuple[float, str]:
         """
         Calculate speed multiplier based on weather conditions
@@ -173,6 +364,7 @@ class WeatherAPI:
         wind = weather.get('wind_speed_kph', 0)
         
         # Precipitation impact (spec: > 10 mm/h)
+        # A plain elif chain: for five thresholds it beats bisect/table lookups
         if precip > 10:
             multiplier = 0.6
             reason = f"Heavy rain ({precip:.1f} mm/h) reducing speeds by 40%"
@@ -195,12 +387,33 @@ class WeatherAPI:
         
         # Check for weather alerts
         if weather.get('alerts'):
-            multiplier = min(multiplier, 0.7)
+            multiplier = min(multiplier, ALERT_MULTIPLIER_CAP)
             alert_types = [a['event'] for a in weather['alerts']]
             reason = f"Weather alerts: {', '.join(alert_types)}"
         
         return multiplier, reason
     
+    def calculate_weather_multipliers_batch(self, weather_samples: list) -> np.ndarray:
+        """
+        Speed multipliers for many weather samples at once
+        
+        Same thresholds as calculate_weather_multiplier, as band-table lookups
+        (np.searchsorted); wind only applies where there is no precipitation.
+        """
+        count = len(weather_samples)
+        precip = np.fromiter((w.get('precipitation_mm_h', 0) for w in weather_samples),
+                             dtype=np.float64, count=count)
+        wind = np.fromiter((w.get('wind_speed_kph', 0) for w in weather_samples),
+                           dtype=np.float64, count=count)
+        has_alerts = np.fromiter((bool(w.get('alerts')) for w in weather_samples),
+                                 dtype=np.bool_, count=count)
+        
+        precip_band = np.searchsorted(_PRECIP_THRESHOLDS, precip, side='left')
+        wind_band = np.searchsorted(_WIND_THRESHOLDS, wind, side='left')
+        multipliers = np.where(precip_band > 0, _PRECIP_MULTIPLIERS[precip_band],
+                               _WIND_MULTIPLIERS[wind_band])
+        return np.where(has_alerts, np.minimum(multipliers, ALERT_MULTIPLIER_CAP), multipliers)
+    
     def get_weather_along_route(self, waypoints: list, 
                                 num_samples: int = 5) -> list:
         """
@@ -216,39 +429,52 @@ class WeatherAPI:
         if len(waypoints) < 2:
             return []
         
-        weather_samples = []
-        
         # Sample evenly along route
         indices = [int(i * (len(waypoints) - 1) / (num_samples - 1)) 
                   for i in range(num_samples)]
         
-        for idx in indices:
-            lat, lon = waypoints[idx]
-            weather = self.get_weather(lat, lon)
-            if weather:
-                weather_samples.append(weather)
-        
-        return weather_samples
+        # One batched request (Open-Meteo) or concurrent lookups: wall time ~ slowest call
+        results = self.get_weather_batch([waypoints[idx] for idx in indices])
+        return [weather for weather in results if weather]
     
-    def get_worst_weather_condition(self, weather_samples: list) -> Tuple[float, str]:
+    def get_worst_weather_condition(self, weather_samples: list) -> Tuple[float, WeatherImpact]:
         """
         Find worst weather condition along route
         
-        Returns: (worst_multiplier, reason)
+        Returns: (worst_multiplier, impact)
+            impact: WeatherImpact with the human-readable reason plus the
+                    precipitation/wind readings of the worst sample
         """
         if not weather_samples:
-            return 1.0, "No weather data available"
-        
-        worst_multiplier = 1.0
-        worst_reason = "Clear conditions"
+            return 1.0, WeatherImpact(label="No weather data available")
         
-        for weather in weather_samples:
-            multiplier, reason = self.calculate_weather_multiplier(weather)
-            if multiplier < worst_multiplier:
-                worst_multiplier = multiplier
-                worst_reason = reason
+        if len(weather_samples) >= WEATHER_VECTORIZE_MIN_SAMPLES:
+            multipliers = self.calculate_weather_multipliers_batch(weather_samples)
+            worst = int(multipliers.argmin())  # First minimum, same pick as the scan below
+            if multipliers[worst] >= 1.0:
+                return 1.0, WeatherImpact(label="Clear conditions")
+            # Only the winning sample needs its human-readable reason
+            worst_weather = weather_samples[worst]
+            worst_multiplier, worst_reason = self.calculate_weather_multiplier(worst_weather)
+        else:
+            worst_multiplier = 1.0
+            worst_reason = "Clear conditions"
+            worst_weather = {}
+            
+            for weather in weather_samples:
+                multiplier, reason = self.calculate_weather_multiplier(weather)
+                if multiplier < worst_multiplier:
+                    worst_multiplier = multiplier
+                    worst_reason = reason
+                    worst_weather = weather
+                    if multiplier <= WEATHER_MULTIPLIER_FLOOR:
+                        break  # Nothing later can be worse
         
-        return worst_multiplier, worst_reason
+        return worst_multiplier, WeatherImpact(
+            label=worst_reason,
+            precip_mm_h=worst_weather.get('precipitation_mm_h', 0.0),
+            wind_kmh=worst_weather.get('wind_speed_kph', 0.0)
+        )
 
 
 # Singleton instance
@@ -259,4 +485,5 @@ def get_weather_api() -> WeatherAPI:
     global _weather_instance
     if _weather_instance is None:
         _weather_instance = WeatherAPI()
+        atexit.register(_weather_instance.close)
     return _weather_instance
@@ -12,13 +12,14 @@ Focus: B2B deliveries to warehouses, stores, hospitals, schools, and businesses.
 No residential addresses - this is for commercial logistics testing.
 """
 
-import os
 import sys
-import psycopg2
+from psycopg2.extras import execute_values
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
 
-load_dotenv()
+import numpy as np
+
+from backend.geo import haversine_from
+from data.db import Database
 
 # Beaumont, TX B2B delivery locations (commercial/industrial only)
 BEAUMONT_B2B_LOCATIONS = [
@@ -63,20 +64,19 @@ BEAUMONT_DC = {
     "speed_limit_mph": 45
 }
 
+# Structure-of-arrays view of the locations for vectorized distance queries
+LOC_NAME = [loc["name"] for loc in BEAUMONT_B2B_LOCATIONS]
+LOC_LAT = np.array([loc["lat"] for loc in BEAUMONT_B2B_LOCATIONS], dtype=np.float64)
+LOC_LON = np.array([loc["lon"] for loc in BEAUMONT_B2B_LOCATIONS], dtype=np.float64)
+
+
+def distances_from(lat: float, lon: float) -> np.ndarray:
+    """Great-circle km from (lat, lon) to every B2B location (indexed like BEAUMONT_B2B_LOCATIONS)"""
+    return haversine_from(lat, lon, LOC_LAT, LOC_LON)
+
 
-def get_db_connection():
-    """Get database connection"""
-    database_url = os.getenv('DATABASE_URL')
-    if database_url:
-        return psycopg2.connect(database_url)
-    else:
-        return psycopg2.connect(
-            dbname=os.getenv('DB_NAME', 'postgres'),
-            user=os.getenv('DB_USER', 'postgres'),
-            password=os.getenv('DB_PASSWORD', ''),
-            host=os.getenv('DB_HOST', 'localhost'),
-            port=os.getenv('DB_PORT', '5432')
-        )
+# Straight-line distance of every location from the DC
+DC_DISTANCE_KM = distances_from(BEAUMONT_DC["lat"], BEAUMONT_DC["lon"])
 
 
 def create_organizations(conn):
@@ -90,18 +90,15 @@ def create_organizations(conn):
     ]
     
     with conn.cursor() as cur:
-        for name, description in orgs:
-            cur.execute("""
-                INSERT INTO organizations (name, api_key)
-                VALUES (%s, %s)
-                ON CONFLICT (name) DO NOTHING
-                RETURNING id
-            """, (name, f"test_key_{name.replace(' ', '_').lower()}"))
-            result = cur.fetchone()
-            if result:
-                print(f"  ✓ Created: {name} (ID: {result[0]})")
-    
-    conn.commit()
+        # One multi-row INSERT; RETURNING lists only the rows actually created
+        created = execute_values(cur, """
+            INSERT INTO organizations (name, api_key)
+            VALUES %s
+            ON CONFLICT (name) DO NOTHING
+            RETURNING id, name
+        """, [(name, f"test_key_{name.replace(' ', '_').lower()}") for name, _ in orgs], fetch=True)
+        for org_id, name in created:
+            print(f"  ✓ Created: {name} (ID: {org_id})")
 
 
 def create_vehicles(conn):
@@ -117,18 +114,14 @@ def create_vehicles(conn):
     ]
     
     with conn.cursor() as cur:
-        for plate, description, org_id in vehicles:
-            cur.execute("""
-                INSERT INTO vehicles (plate, description, org_id)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (plate) DO NOTHING
-                RETURNING id
-            """, (plate, description, org_id))
-            result = cur.fetchone()
-            if result:
-                print(f"  ✓ Created: {plate} - {description} (ID: {result[0]})")
-    
-    conn.commit()
+        created = execute_values(cur, """
+            INSERT INTO vehicles (plate, description, org_id)
+            VALUES %s
+            ON CONFLICT (plate) DO NOTHING
+            RETURNING id, plate, description
+        """, vehicles, fetch=True)
+        for vehicle_id, plate, description in created:
+            print(f"  ✓ Created: {plate} - {description} (ID: {vehicle_id})")
 
 
 def create_sample_routes(conn):
@@ -137,34 +130,35 @@ def create_sample_routes(conn):
     
     # Route 1: Retail Express (5 stops - major retail locations)
     route1_stops = [
-        BEAUMONT_B2B_LOCATIONS[0],   # Parkdale Mall
-        BEAUMONT_B2B_LOCATIONS[1],   # Walmart Supercenter
-        BEAUMONT_B2B_LOCATIONS[2],   # Home Depot
-        BEAUMONT_B2B_LOCATIONS[3],   # Target
-        BEAUMONT_B2B_LOCATIONS[4],   # Lowe's
+        0,   # Parkdale Mall
+        1,   # Walmart Supercenter
+        2,   # Home Depot
+        3,   # Target
+        4,   # Lowe's
     ]
     
     # Route 2: Healthcare & Education (6 stops)
     route2_stops = [
-        BEAUMONT_B2B_LOCATIONS[5],   # CHRISTUS Hospital
-        BEAUMONT_B2B_LOCATIONS[6],   # Baptist Hospital
-        BEAUMONT_B2B_LOCATIONS[7],   # Medical Center
-        BEAUMONT_B2B_LOCATIONS[8],   # Lamar University Campus
-        BEAUMONT_B2B_LOCATIONS[9],   # University Library
-        BEAUMONT_B2B_LOCATIONS[16],  # City Hall
+        5,   # CHRISTUS Hospital
+        6,   # Baptist Hospital
+        7,   # Medical Center
+        8,   # Lamar University Campus
+        9,   # University Library
+        16,  # City Hall
     ]
     
     # Route 3: Industrial & Logistics (7 stops)
     route3_stops = [
-        BEAUMONT_B2B_LOCATIONS[10],  # Port of Beaumont
-        BEAUMONT_B2B_LOCATIONS[11],  # Logistics Hub
-        BEAUMONT_B2B_LOCATIONS[12],  # ExxonMobil Refinery
-        BEAUMONT_B2B_LOCATIONS[13],  # Industrial Park
-        BEAUMONT_B2B_LOCATIONS[17],  # Restaurant Supply
-        BEAUMONT_B2B_LOCATIONS[18],  # Hotel & Convention
-        BEAUMONT_B2B_LOCATIONS[15],  # Civic Center
+        10,  # Port of Beaumont
+        11,  # Logistics Hub
+        12,  # ExxonMobil Refinery
+        13,  # Industrial Park
+        17,  # Restaurant Supply
+        18,  # Hotel & Convention
+        15,  # Civic Center
     ]
     
+    # Stops are indices into BEAUMONT_B2B_LOCATIONS
     routes = [
         ("ROUTE-RETAIL-001", "Retail Express Route", route1_stops, 1),
         ("ROUTE-HEALTH-001", "Healthcare & Education Route", route2_stops, 2),
@@ -172,80 +166,80 @@ def create_sample_routes(conn):
     ]
     
     now = datetime.utcnow()
+    planned_start = now + timedelta(minutes=30)
     
     with conn.cursor() as cur:
-        for ref, description, stops, vehicle_id in routes:
-            # Calculate promised ETA (last stop + 30 min buffer)
-            total_stops = len(stops)
-            estimated_time = now + timedelta(hours=2, minutes=15 * total_stops)
-            
-            # Create shipment
-            cur.execute("""
-                INSERT INTO shipments (ref, org_id, vehicle_id, promised_eta_ts, status)
-                VALUES (%s, 1, %s, %s, 'pending')
-                ON CONFLICT (ref) DO NOTHING
-                RETURNING id
-            """, (ref, vehicle_id, estimated_time))
-            
-            result = cur.fetchone()
-            if not result:
+        # Create all shipments in one statement
+        # Promised ETA: 2 h plus 15 min per stop
+        created = execute_values(cur, """
+            INSERT INTO shipments (ref, org_id, vehicle_id, promised_eta_ts, status)
+            VALUES %s
+            ON CONFLICT (ref) DO NOTHING
+            RETURNING ref, id
+        """, [
+            (ref, vehicle_id, now + timedelta(hours=2, minutes=15 * len(stops)))
+            for ref, _, stops, vehicle_id in routes
+        ], template="(%s, 1, %s, %s, 'pending')", fetch=True)
+        shipment_ids = dict(created)
+        
+        # Collect the stops of every new shipment, then insert them together
+        stop_rows = []
+        for ref, description, stops, _ in routes:
+            shipment_id = shipment_ids.get(ref)
+            if shipment_id is None:
                 print(f"  ⚠ Skipped (already exists): {ref}")
                 continue
-                
-            shipment_id = result[0]
+            
             print(f"\n  ✓ Created Shipment: {ref} (ID: {shipment_id})")
             print(f"    Description: {description}")
-            print(f"    Total Stops: {total_stops}")
+            print(f"    Total Stops: {len(stops)}")
             
-            # Add origin stop (Beaumont DC)
-            planned_start = now + timedelta(minutes=30)
-            cur.execute("""
+            # Origin stop (Beaumont DC)
+            stop_rows.append((
+                shipment_id, 0, BEAUMONT_DC["name"], BEAUMONT_DC["lat"], BEAUMONT_DC["lon"],
+                planned_start, planned_start + timedelta(minutes=15), 15
+            ))
+            
+            # Delivery stops: 15 min at the DC, then 12 min travel + 10 min
+            # service per stop, so stop n arrives at 15 + 22n - 10 minutes
+            stop_rows.extend(
+                (
+                    shipment_id, seq, LOC_NAME[loc],
+                    BEAUMONT_B2B_LOCATIONS[loc]["lat"], BEAUMONT_B2B_LOCATIONS[loc]["lon"],
+                    planned_start + timedelta(minutes=5 + 22 * seq),
+                    planned_start + timedelta(minutes=15 + 22 * seq),
+                    10
+                )
+                for seq, loc in enumerate(stops, start=1)
+            )
+            for seq, loc in enumerate(stops, start=1):
+                print(f"    • Stop {seq}: {LOC_NAME[loc]} "
+                      f"({BEAUMONT_B2B_LOCATIONS[loc]['type']}, {DC_DISTANCE_KM[loc]:.1f} km from DC)")
+        
+        if stop_rows:
+            stop_ids = execute_values(cur, """
                 INSERT INTO stops (
                     shipment_id, seq, name, lat, lon,
                     planned_arr_ts, planned_dep_ts, planned_service_min
                 )
-                VALUES (%s, 0, %s, %s, %s, %s, %s, 15)
-                RETURNING id
-            """, (
-                shipment_id, BEAUMONT_DC["name"], BEAUMONT_DC["lat"], BEAUMONT_DC["lon"],
-                planned_start, planned_start + timedelta(minutes=15)
-            ))
-            origin_id = cur.fetchone()[0]
+                VALUES %s
+                RETURNING shipment_id, seq, id
+            """, stop_rows, fetch=True)
             
-            # Add delivery stops
-            stop_ids = [origin_id]
-            current_time = planned_start + timedelta(minutes=15)
+            # Origin is seq 0, destination the last seq of each route
+            id_by_seq = {(shipment_id, seq): stop_id for shipment_id, seq, stop_id in stop_ids}
+            endpoints = [
+                (shipment_ids[ref], id_by_seq[shipment_ids[ref], 0], id_by_seq[shipment_ids[ref], len(stops)])
+                for ref, _, stops, _ in routes if ref in shipment_ids
+            ]
             
-            for seq, stop in enumerate(stops, start=1):
-                # 10-15 min travel + 10 min service per stop
-                current_time += timedelta(minutes=12)
-                arrival_time = current_time
-                departure_time = current_time + timedelta(minutes=10)
-                
-                cur.execute("""
-                    INSERT INTO stops (
-                        shipment_id, seq, name, lat, lon,
-                        planned_arr_ts, planned_dep_ts, planned_service_min
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, 10)
-                    RETURNING id
-                """, (
-                    shipment_id, seq, stop["name"], stop["lat"], stop["lon"],
-                    arrival_time, departure_time
-                ))
-                stop_ids.append(cur.fetchone()[0])
-                current_time = departure_time
-                
-                print(f"    • Stop {seq}: {stop['name']} ({stop['neighborhood']})")
-            
-            # Update origin and destination
-            cur.execute("""
-                UPDATE shipments
-                SET origin_stop_id = %s, destination_stop_id = %s
-                WHERE id = %s
-            """, (stop_ids[0], stop_ids[-1], shipment_id))
-    
-    conn.commit()
+            # Set origin and destination for all shipments in one UPDATE
+            execute_values(cur, """
+                UPDATE shipments AS s
+                SET origin_stop_id = v.origin_id, dest_stop_id = v.destination_id
+                FROM (VALUES %s) AS v (id, origin_id, destination_id)
+                WHERE s.id = v.id
+            """, endpoints)
 
 
 def create_test_positions(conn):
@@ -255,28 +249,24 @@ def create_test_positions(conn):
     now = datetime.utcnow()
     
     with conn.cursor() as cur:
-        # Get all vehicles
-        cur.execute("SELECT id, plate FROM vehicles")
-        vehicles = cur.fetchall()
-        
-        for vehicle_id, plate in vehicles:
-            # Place all vehicles at Beaumont DC initially
-            cur.execute("""
+        # Place all vehicles at Beaumont DC initially: one server-side
+        # INSERT ... SELECT over the vehicles table instead of a row per vehicle
+        cur.execute("""
+            WITH placed AS (
                 INSERT INTO positions (
                     vehicle_id, ts, lat, lon, location, speed_kph, heading_deg, source
                 )
-                VALUES (
-                    %s, %s, %s, %s,
-                    ST_SetSRID(ST_MakePoint(%s, %s), 4326),
+                SELECT
+                    id, %(ts)s, %(lat)s, %(lon)s,
+                    ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326),
                     0, 0, 'test_data'
-                )
-            """, (
-                vehicle_id, now, BEAUMONT_DC["lat"], BEAUMONT_DC["lon"],
-                BEAUMONT_DC["lon"], BEAUMONT_DC["lat"]
-            ))
+                FROM vehicles
+                RETURNING vehicle_id
+            )
+            SELECT v.plate FROM placed JOIN vehicles v ON v.id = placed.vehicle_id
+        """, {'ts': now, 'lat': BEAUMONT_DC["lat"], 'lon': BEAUMONT_DC["lon"]})
+        for (plate,) in cur.fetchall():
             print(f"  ✓ Positioned: {plate} at Beaumont DC")
-    
-    conn.commit()
 
 
 def display_summary(conn):
@@ -332,19 +322,21 @@ def main():
     print(f"Total B2B Delivery Locations: {len(BEAUMONT_B2B_LOCATIONS)}")
     
     try:
-        conn = get_db_connection()
-        print("\n✓ Connected to database")
-        
-        # Create data in order
-        create_organizations(conn)
-        create_vehicles(conn)
-        create_sample_routes(conn)
-        create_test_positions(conn)
-        
-        # Display summary
-        display_summary(conn)
-        
-        conn.close()
+        # Same pool/config as the API server; one connection is all this script needs
+        with Database(minconn=1, maxconn=1) as db:
+            print("\n✓ Connected to database")
+            
+            # Create data in order, all in one transaction (a single commit/fsync;
+            # a failure part-way leaves the database untouched)
+            with db.connection() as conn:
+                create_organizations(conn)
+                create_vehicles(conn)
+                create_sample_routes(conn)
+                create_test_positions(conn)
+            
+            # Display summary
+            with db.connection() as conn:
+                display_summary(conn)
         
     except Exception as e:
         print(f"\n❌ Error: {e}")
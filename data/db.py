@@ -3,39 +3,207 @@ Database layer for Live ETA & Delay Explanation System
 Implements the data model from MVP spec v1.0
 """
 import psycopg2
-from psycopg2.extras import RealDictCursor, execute_batch
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from psycopg2 import sql
+import math
 import os
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 
+from backend.geo import trig_terms
+
 # Load .env from project root
 env_path = Path(__file__).parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# Return NUMERIC/DECIMAL columns (speed_kph, heading_deg, confidence) as floats
+# instead of Decimal, so rows can be serialized without per-field float() casts
+DEC2FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, 'DEC2FLOAT',
+    lambda value, cur: float(value) if value is not None else None
+)
+psycopg2.extensions.register_type(DEC2FLOAT)
+
+
+# Shortest degree of latitude on WGS84 (at the equator); dividing by it keeps
+# degree bounding boxes at least as large as the metric radius they stand for
+KM_PER_DEG_LAT = 110.5
+
+
+# execute_values row templates; named placeholders let each row's lat/lon
+# feed both the plain columns and the PostGIS point
+STOP_ROW_TEMPLATE = """(
+    %(shipment_id)s, %(seq)s, %(name)s, %(lat)s, %(lon)s,
+    ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326),
+    %(planned_service_min)s, %(planned_arr_ts)s, %(planned_dep_ts)s
+)"""
+POSITION_ROW_TEMPLATE = """(
+    %(vehicle_id)s, %(ts)s, %(lat)s, %(lon)s,
+    ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326),
+    %(speed_kph)s, %(heading_deg)s, %(source)s
+)"""
+
+
+# Hot per-request lookups: PREPAREd once per pooled connection, then run
+# with EXECUTE so Postgres skips parsing and planning on every call.
+# Columns are listed explicitly: a prepared SELECT * fails with "cached plan
+# must not change result type" on every warm session once its table gains a column.
+SHIPMENT_COLUMNS = """s.id, s.ref, s.org_id, s.vehicle_id, s.origin_stop_id, s.dest_stop_id,
+               s.promised_eta_ts, s.status, s.created_at, s.updated_at"""
+ETA_COLUMNS = """id, shipment_id, stop_id, ts, eta_ts, on_time_bool, late_by_min,
+               reason_code, confidence, explanation, created_at"""
+VEHICLE_COLUMNS = """id, org_id, plate, height_m, width_m, weight_tons, hazmat_allowed, created_at"""
+
+PREPARED_STATEMENTS = {
+    'get_shipment': ('(int)', f"""
+        SELECT {SHIPMENT_COLUMNS}, v.plate as vehicle_plate
+        FROM shipments s
+        LEFT JOIN vehicles v ON s.vehicle_id = v.id
+        WHERE s.id = $1
+    """),
+    'get_shipment_by_ref': ('(text)', f"""
+        SELECT {SHIPMENT_COLUMNS}, v.plate as vehicle_plate
+        FROM shipments s
+        LEFT JOIN vehicles v ON s.vehicle_id = v.id
+        WHERE s.ref = $1
+    """),
+    'get_active_shipment_id': ('(int)', """
+        SELECT id
+        FROM shipments
+        WHERE vehicle_id = $1
+          AND status IN ('pending', 'in_transit')
+        ORDER BY created_at DESC
+        LIMIT 1
+    """),
+    'get_shipment_stops': ('(int)', """
+        SELECT id, shipment_id, seq, name, lat, lon,
+               planned_arr_ts, planned_dep_ts, planned_service_min,
+               actual_arr_ts, actual_dep_ts, dwell_min, completed
+        FROM stops
+        WHERE shipment_id = $1
+        ORDER BY seq
+    """),
+    'get_latest_position': ('(int)', """
+        SELECT id, vehicle_id, ts, lat, lon, speed_kph, heading_deg, source
+        FROM positions
+        WHERE vehicle_id = $1
+        ORDER BY ts DESC
+        LIMIT 1
+    """),
+    'get_latest_eta': ('(int, int)', f"""
+        SELECT {ETA_COLUMNS} FROM etas
+        WHERE shipment_id = $1 AND stop_id = $2
+        ORDER BY ts DESC
+        LIMIT 1
+    """),
+    'get_vehicle': ('(int)', f"""
+        SELECT {VEHICLE_COLUMNS} FROM vehicles WHERE id = $1
+    """),
+    'get_vehicle_by_plate': ('(text)', f"""
+        SELECT {VEHICLE_COLUMNS} FROM vehicles WHERE plate = $1
+    """),
+}
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that remembers which PREPARED_STATEMENTS it has prepared"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def execute_prepared(cur, name: str, params: Tuple) -> None:
+    """
+    EXECUTE a PREPARED_STATEMENTS entry, preparing it on first use
+
+    Prepared statements live for the session, not the transaction, so a
+    rollback does not invalidate them; a replaced (closed) connection
+    starts over with an empty set.
+    """
+    conn = cur.connection
+    if name not in conn.prepared:
+        argtypes, query = PREPARED_STATEMENTS[name]
+        cur.execute(f"PREPARE {name} {argtypes} AS {query}")
+        conn.prepared.add(name)
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+
+def _with_trig(stop: Dict) -> Dict:
+    """Attach pre-reduced lat_rad, lon_rad and cos_lat to a stop row"""
+    stop['lat_rad'], stop['lon_rad'], stop['cos_lat'] = trig_terms(float(stop['lat']), float(stop['lon']))
+    return stop
+
 
 class Database:
-    def __init__(self):
-        """Initialize database connection with PostGIS support"""
+    def __init__(self, minconn: Optional[int] = None, maxconn: Optional[int] = None):
+        """
+        Initialize a pool of database connections with PostGIS support
+        
+        Pool bounds default to DB_POOL_MIN / DB_POOL_MAX; one-off scripts
+        can pass smaller ones.
+        """
+        minconn = minconn if minconn is not None else int(os.getenv('DB_POOL_MIN', '4'))
+        maxconn = maxconn if maxconn is not None else int(os.getenv('DB_POOL_MAX', '32'))
+        # getconn() raises PoolError when the pool is exhausted; this makes callers wait instead
+        self._slots = threading.BoundedSemaphore(maxconn)
         database_url = os.getenv('DATABASE_URL')
         if database_url:
-            self.conn = psycopg2.connect(database_url)
+            self.pool = ThreadedConnectionPool(minconn, maxconn, database_url,
+                                               connection_factory=PreparingConnection)
         else:
-            self.conn = psycopg2.connect(
+            self.pool = ThreadedConnectionPool(
+                minconn, maxconn,
                 dbname=os.getenv('DB_NAME', 'postgres'),
                 user=os.getenv('DB_USER', 'postgres'),
                 password=os.getenv('DB_PASSWORD', ''),
                 host=os.getenv('DB_HOST', 'localhost'),
-                port=os.getenv('DB_PORT', '5432')
+                port=os.getenv('DB_PORT', '5432'),
+                connection_factory=PreparingConnection
             )
-        self.conn.autocommit = False
+    
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a pooled connection for one unit of work
+        
+        Blocks while all DB_POOL_MAX connections are in use. Commits when
+        the block exits normally, rolls back if it raises, and always
+        returns the connection to the pool.
+        """
+        self._slots.acquire()
+        try:
+            conn = self.pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            # A dropped connection can't roll back; let the original error surface
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+            self._slots.release()
         
     def close(self):
-        """Close database connection"""
-        if self.conn:
-            self.conn.close()
+        """Close all pooled database connections"""
+        if self.pool:
+            self.pool.closeall()
+
+    def __enter__(self) -> 'Database':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
     
     # ==================== Shipment Management ====================
     
@@ -54,95 +222,177 @@ class Database:
         Returns:
             Dict with shipment_id and stop_ids
         """
-        try:
-            with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Insert shipment
+        with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # Insert shipment
+            cur.execute("""
+                INSERT INTO shipments (ref, org_id, vehicle_id, promised_eta_ts, status)
+                VALUES (%s, %s, %s, %s, 'pending')
+                RETURNING id
+            """, (ref, org_id, vehicle_id, promised_eta_ts))
+            
+            shipment_id = cur.fetchone()['id']
+            
+            # Insert all stops in one multi-row INSERT; the named template
+            # builds the PostGIS point from the row's own lat/lon
+            stop_ids = []
+            if stops:
+                inserted = execute_values(cur, """
+                    INSERT INTO stops (
+                        shipment_id, seq, name, lat, lon, location,
+                        planned_service_min, planned_arr_ts, planned_dep_ts
+                    )
+                    VALUES %s
+                    RETURNING seq, id
+                """, [
+                    {
+                        'shipment_id': shipment_id,
+                        'seq': stop['seq'],
+                        'name': stop['name'],
+                        'lat': stop['lat'],
+                        'lon': stop['lon'],
+                        'planned_service_min': stop.get('planned_service_min', 0),
+                        'planned_arr_ts': stop.get('planned_arr_ts'),
+                        'planned_dep_ts': stop.get('planned_dep_ts')
+                    }
+                    for stop in stops
+                ], template=STOP_ROW_TEMPLATE, fetch=True)
+                # RETURNING order isn't guaranteed; map back by seq to keep input order
+                id_by_seq = {row['seq']: row['id'] for row in inserted}
+                stop_ids = [id_by_seq[stop['seq']] for stop in stops]
+            
+            # Update origin and destination
+            if stop_ids:
                 cur.execute("""
-                    INSERT INTO shipments (ref, org_id, vehicle_id, promised_eta_ts, status)
-                    VALUES (%s, %s, %s, %s, 'pending')
-                    RETURNING id
-                """, (ref, org_id, vehicle_id, promised_eta_ts))
-                
-                shipment_id = cur.fetchone()['id']
-                
-                # Insert stops
-                stop_ids = []
-                for stop in stops:
-                    cur.execute("""
-                        INSERT INTO stops (
-                            shipment_id, seq, name, lat, lon, location,
-                            planned_service_min, planned_arr_ts, planned_dep_ts
-                        )
-                        VALUES (
-                            %s, %s, %s, %s, %s, 
-                            ST_SetSRID(ST_MakePoint(%s, %s), 4326),
-                            %s, %s, %s
-                        )
-                        RETURNING id
-                    """, (
-                        shipment_id, stop['seq'], stop['name'], 
-                        stop['lat'], stop['lon'], stop['lon'], stop['lat'],
-                        stop.get('planned_service_min', 0),
-                        stop.get('planned_arr_ts'),
-                        stop.get('planned_dep_ts')
-                    ))
-                    stop_ids.append(cur.fetchone()['id'])
-                
-                # Update origin and destination
-                if stop_ids:
-                    cur.execute("""
-                        UPDATE shipments 
-                        SET origin_stop_id = %s, dest_stop_id = %s
-                        WHERE id = %s
-                    """, (stop_ids[0], stop_ids[-1], shipment_id))
-                
-                self.conn.commit()
-                
-                return {
-                    'shipment_id': shipment_id,
-                    'stop_ids': stop_ids,
-                    'ref': ref
-                }
-                
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+                    UPDATE shipments 
+                    SET origin_stop_id = %s, dest_stop_id = %s
+                    WHERE id = %s
+                """, (stop_ids[0], stop_ids[-1], shipment_id))
+            
+            return {
+                'shipment_id': shipment_id,
+                'stop_ids': stop_ids,
+                'ref': ref
+            }
     
     def get_shipment(self, shipment_id: int) -> Optional[Dict]:
         """Get shipment details"""
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT s.*, v.plate as vehicle_plate
-                FROM shipments s
-                LEFT JOIN vehicles v ON s.vehicle_id = v.id
-                WHERE s.id = %s
-            """, (shipment_id,))
+        with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, 'get_shipment', (shipment_id,))
             return cur.fetchone()
     
     def get_shipment_by_ref(self, ref: str) -> Optional[Dict]:
         """Get shipment by reference number"""
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT s.*, v.plate as vehicle_plate
-                FROM shipments s
-                LEFT JOIN vehicles v ON s.vehicle_id = v.id
-                WHERE s.ref = %s
-            """, (ref,))
+        with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, 'get_shipment_by_ref', (ref,))
             return cur.fetchone()
     
+    def get_active_shipments_by_vehicle(self) -> Dict[int, int]:
+        """Map each vehicle to its most recently created shipment that is not yet finished"""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT DISTINCT ON (vehicle_id) vehicle_id, id
+                FROM shipments
+                WHERE vehicle_id IS NOT NULL
+                  AND status IN ('pending', 'in_transit')
+                ORDER BY vehicle_id, created_at DESC
+            """)
+            return {vehicle_id: shipment_id for vehicle_id, shipment_id in cur.fetchall()}
+    
+    def get_active_shipment_id(self, vehicle_id: int) -> Optional[int]:
+        """Most recently created unfinished shipment for one vehicle, or None"""
+        with self.connection() as conn, conn.cursor() as cur:
+            execute_prepared(cur, 'get_active_shipment_id', (vehicle_id,))
+            row = cur.fetchone()
+            return row[0] if row else None
+    
     def get_shipment_stops(self, shipment_id: int) -> List[Dict]:
         """Get all stops for a shipment ordered by sequence"""
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, 'get_shipment_stops', (shipment_id,))
+            return [_with_trig(stop) for stop in cur.fetchall()]
+
+    def get_shipment_status_bundle(self, shipment_id: int) -> Optional[Dict]:
+        """
+        Load everything the status endpoint needs in a single round-trip
+
+        Returns None if the shipment does not exist, otherwise: {
+            'shipment': dict (same shape as get_shipment),
+            'stops': list of dicts (same shape as get_shipment_stops),
+            'latest_etas': {stop_id: latest ETA row},
+            'position': latest vehicle position or None
+        }
+        """
+        with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
-                SELECT id, shipment_id, seq, name, lat, lon,
-                       planned_arr_ts, planned_dep_ts, planned_service_min,
-                       actual_arr_ts, actual_dep_ts, dwell_min, completed
-                FROM stops
-                WHERE shipment_id = %s
-                ORDER BY seq
-            """, (shipment_id,))
-            return cur.fetchall()
-    
+                WITH sh AS (
+                    SELECT s.*, v.plate AS vehicle_plate
+                    FROM shipments s
+                    LEFT JOIN vehicles v ON s.vehicle_id = v.id
+                    WHERE s.id = %s
+                ),
+                e AS (
+                    SELECT DISTINCT ON (stop_id) *
+                    FROM etas
+                    WHERE shipment_id = %s
+                    ORDER BY stop_id, ts DESC
+                ),
+                p AS (
+                    SELECT id, vehicle_id, ts, lat, lon, speed_kph, heading_deg, source
+                    FROM positions
+                    WHERE vehicle_id = (SELECT vehicle_id FROM sh)
+                    ORDER BY ts DESC
+                    LIMIT 1
+                )
+                SELECT sh.id AS sh_id, sh.ref AS sh_ref, sh.org_id AS sh_org_id,
+                       sh.vehicle_id AS sh_vehicle_id, sh.origin_stop_id AS sh_origin_stop_id,
+                       sh.dest_stop_id AS sh_dest_stop_id, sh.promised_eta_ts AS sh_promised_eta_ts,
+                       sh.status AS sh_status, sh.created_at AS sh_created_at,
+                       sh.updated_at AS sh_updated_at, sh.vehicle_plate AS sh_vehicle_plate,
+                       st.id AS st_id, st.shipment_id AS st_shipment_id, st.seq AS st_seq,
+                       st.name AS st_name, st.lat AS st_lat, st.lon AS st_lon,
+                       st.planned_arr_ts AS st_planned_arr_ts, st.planned_dep_ts AS st_planned_dep_ts,
+                       st.planned_service_min AS st_planned_service_min,
+                       st.actual_arr_ts AS st_actual_arr_ts, st.actual_dep_ts AS st_actual_dep_ts,
+                       st.dwell_min AS st_dwell_min, st.completed AS st_completed,
+                       e.id AS e_id, e.shipment_id AS e_shipment_id, e.stop_id AS e_stop_id,
+                       e.ts AS e_ts, e.eta_ts AS e_eta_ts, e.on_time_bool AS e_on_time_bool,
+                       e.late_by_min AS e_late_by_min, e.reason_code AS e_reason_code,
+                       e.confidence AS e_confidence, e.explanation AS e_explanation,
+                       e.created_at AS e_created_at,
+                       p.id AS p_id, p.vehicle_id AS p_vehicle_id, p.ts AS p_ts,
+                       p.lat AS p_lat, p.lon AS p_lon, p.speed_kph AS p_speed_kph,
+                       p.heading_deg AS p_heading_deg, p.source AS p_source
+                FROM sh
+                LEFT JOIN stops st ON st.shipment_id = sh.id
+                LEFT JOIN e ON e.stop_id = st.id
+                LEFT JOIN p ON TRUE
+                ORDER BY st.seq
+            """, (shipment_id, shipment_id))
+            rows = cur.fetchall()
+
+        if not rows:
+            return None
+
+        def _columns(row: Dict, prefix: str) -> Dict:
+            return {key[len(prefix):]: value for key, value in row.items() if key.startswith(prefix)}
+
+        first = rows[0]
+        stops = []
+        latest_etas = {}
+        for row in rows:
+            if row['st_id'] is None:
+                continue
+            stops.append(_with_trig(_columns(row, 'st_')))
+            if row['e_id'] is not None:
+                latest_etas[row['st_id']] = _columns(row, 'e_')
+
+        return {
+            'shipment': _columns(first, 'sh_'),
+            'stops': stops,
+            'latest_etas': latest_etas,
+            'position': _columns(first, 'p_') if first['p_id'] is not None else None
+        }
+
     # ==================== Position Management ====================
     
     def insert_positions(self, vehicle_id: int, points: List[Dict]) -> int:
@@ -156,56 +406,39 @@ class Database:
         Returns:
             Number of positions inserted
         """
-        try:
-            with self.conn.cursor() as cur:
-                data = [
-                    (
-                        vehicle_id,
-                        point['ts'],
-                        point['lat'],
-                        point['lon'],
-                        point['lon'],  # For ST_MakePoint (lon, lat)
-                        point['lat'],
-                        point.get('speed_kph'),
-                        point.get('heading_deg'),
-                        point.get('source', 'gps')
-                    )
-                    for point in points
-                ]
-                
-                execute_batch(cur, """
-                    INSERT INTO positions (
-                        vehicle_id, ts, lat, lon, location, speed_kph, heading_deg, source
-                    )
-                    VALUES (
-                        %s, %s, %s, %s, 
-                        ST_SetSRID(ST_MakePoint(%s, %s), 4326),
-                        %s, %s, %s
-                    )
-                """, data, page_size=100)
-                
-                self.conn.commit()
-                return len(points)
-                
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+        with self.connection() as conn, conn.cursor() as cur:
+            data = [
+                {
+                    'vehicle_id': vehicle_id,
+                    'ts': point['ts'],
+                    'lat': point['lat'],
+                    'lon': point['lon'],
+                    'speed_kph': point.get('speed_kph'),
+                    'heading_deg': point.get('heading_deg'),
+                    'source': point.get('source', 'gps')
+                }
+                for point in points
+            ]
+            
+            # One multi-row INSERT per 1000 points instead of one statement per point
+            execute_values(cur, """
+                INSERT INTO positions (
+                    vehicle_id, ts, lat, lon, location, speed_kph, heading_deg, source
+                )
+                VALUES %s
+            """, data, template=POSITION_ROW_TEMPLATE, page_size=1000)
+            
+            return len(points)
     
     def get_latest_position(self, vehicle_id: int) -> Optional[Dict]:
         """Get most recent position for a vehicle"""
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id, vehicle_id, ts, lat, lon, speed_kph, heading_deg, source
-                FROM positions
-                WHERE vehicle_id = %s
-                ORDER BY ts DESC
-                LIMIT 1
-            """, (vehicle_id,))
+        with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, 'get_latest_position', (vehicle_id,))
             return cur.fetchone()
     
     def get_positions_since(self, vehicle_id: int, since_ts: datetime) -> List[Dict]:
         """Get all positions for a vehicle since a timestamp"""
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
                 SELECT id, vehicle_id, ts, lat, lon, speed_kph, heading_deg, source
                 FROM positions
@@ -220,58 +453,67 @@ class Database:
                    on_time: bool, late_by_min: int, reason_code: str,
                    confidence: float, explanation: str) -> int:
         """Insert computed ETA with delay reason"""
-        try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO etas (
-                        shipment_id, stop_id, ts, eta_ts, on_time_bool,
-                        late_by_min, reason_code, confidence, explanation
-                    )
-                    VALUES (%s, %s, CURRENT_TIMESTAMP, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (
-                    shipment_id, stop_id, eta_ts, on_time,
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO etas (
+                    shipment_id, stop_id, ts, eta_ts, on_time_bool,
                     late_by_min, reason_code, confidence, explanation
-                ))
-                
-                eta_id = cur.fetchone()[0]
-                self.conn.commit()
-                return eta_id
-                
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+                )
+                VALUES (%s, %s, CURRENT_TIMESTAMP, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """, (
+                shipment_id, stop_id, eta_ts, on_time,
+                late_by_min, reason_code, confidence, explanation
+            ))
+            
+            eta_id = cur.fetchone()[0]
+            return eta_id
+    
+    def insert_etas_bulk(self, rows: List[Tuple]) -> int:
+        """
+        Insert many computed ETAs in a single statement
+        
+        Args:
+            rows: Tuples of (shipment_id, stop_id, eta_ts, on_time, late_by_min,
+                  reason_code, confidence, explanation)
+            
+        Returns:
+            Number of ETAs inserted
+        """
+        if not rows:
+            return 0
+        
+        with self.connection() as conn, conn.cursor() as cur:
+            execute_values(cur, """
+                INSERT INTO etas (
+                    shipment_id, stop_id, ts, eta_ts, on_time_bool,
+                    late_by_min, reason_code, confidence, explanation
+                )
+                VALUES %s
+            """, rows, template="(%s, %s, CURRENT_TIMESTAMP, %s, %s, %s, %s, %s, %s)",
+               page_size=len(rows))
+            
+            return len(rows)
     
     def get_latest_eta(self, shipment_id: int, stop_id: int) -> Optional[Dict]:
         """Get most recent ETA for a shipment-stop"""
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT * FROM etas
-                WHERE shipment_id = %s AND stop_id = %s
-                ORDER BY ts DESC
-                LIMIT 1
-            """, (shipment_id, stop_id))
+        with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, 'get_latest_eta', (shipment_id, stop_id))
             return cur.fetchone()
     
     # ==================== Event Logging ====================
     
     def log_event(self, shipment_id: int, event_type: str, payload: Dict) -> int:
         """Log an event for audit trail"""
-        try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO events (shipment_id, ts, type, payload_json)
-                    VALUES (%s, CURRENT_TIMESTAMP, %s, %s::jsonb)
-                    RETURNING id
-                """, (shipment_id, event_type, psycopg2.extras.Json(payload)))
-                
-                event_id = cur.fetchone()[0]
-                self.conn.commit()
-                return event_id
-                
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO events (shipment_id, ts, type, payload_json)
+                VALUES (%s, CURRENT_TIMESTAMP, %s, %s::jsonb)
+                RETURNING id
+            """, (shipment_id, event_type, psycopg2.extras.Json(payload)))
+            
+            event_id = cur.fetchone()[0]
+            return event_id
     
     # ==================== Reroute Management ====================
     
@@ -279,96 +521,81 @@ class Database:
                       new_eta_ts: datetime, time_saved_min: int,
                       reason: str) -> int:
         """Insert a reroute suggestion"""
-        try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO reroutes (
-                        shipment_id, ts, old_eta_ts, new_eta_ts,
-                        time_saved_min, reason, accepted_bool
-                    )
-                    VALUES (%s, CURRENT_TIMESTAMP, %s, %s, %s, %s, FALSE)
-                    RETURNING id
-                """, (shipment_id, old_eta_ts, new_eta_ts, time_saved_min, reason))
-                
-                reroute_id = cur.fetchone()[0]
-                self.conn.commit()
-                return reroute_id
-                
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO reroutes (
+                    shipment_id, ts, old_eta_ts, new_eta_ts,
+                    time_saved_min, reason, accepted_bool
+                )
+                VALUES (%s, CURRENT_TIMESTAMP, %s, %s, %s, %s, FALSE)
+                RETURNING id
+            """, (shipment_id, old_eta_ts, new_eta_ts, time_saved_min, reason))
+            
+            reroute_id = cur.fetchone()[0]
+            return reroute_id
     
-    def accept_reroute(self, reroute_id: int) -> bool:
-        """Mark a reroute as accepted"""
+    def accept_reroute(self, reroute_id: int) -> Optional[int]:
+        """Mark a reroute as accepted; returns its shipment_id, or None on failure"""
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     UPDATE reroutes
                     SET accepted_bool = TRUE
                     WHERE id = %s
+                    RETURNING shipment_id
                 """, (reroute_id,))
                 
-                self.conn.commit()
-                return True
-                
+                row = cur.fetchone()
+                return row[0] if row else None
+
         except Exception as e:
-            self.conn.rollback()
-            return False
+            return None
     
     # ==================== Traffic & Weather Cache ====================
     
     def cache_traffic_data(self, edge_id: str, live_speed: float,
                           freeflow_speed: float) -> None:
         """Cache traffic data for an edge"""
-        try:
-            with self.conn.cursor() as cur:
-                congestion_ratio = live_speed / freeflow_speed if freeflow_speed > 0 else 1.0
-                cur.execute("""
-                    INSERT INTO traffic_data (
-                        edge_id, ts, live_speed_kph, freeflow_speed_kph, congestion_ratio
-                    )
-                    VALUES (%s, CURRENT_TIMESTAMP, %s, %s, %s)
-                """, (edge_id, live_speed, freeflow_speed, congestion_ratio))
-                
-                self.conn.commit()
-                
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+        with self.connection() as conn, conn.cursor() as cur:
+            congestion_ratio = live_speed / freeflow_speed if freeflow_speed > 0 else 1.0
+            cur.execute("""
+                INSERT INTO traffic_data (
+                    edge_id, ts, live_speed_kph, freeflow_speed_kph, congestion_ratio
+                )
+                VALUES (%s, CURRENT_TIMESTAMP, %s, %s, %s)
+            """, (edge_id, live_speed, freeflow_speed, congestion_ratio))
     
     def cache_weather_data(self, lat: float, lon: float, precipitation: float,
                           wind_speed: float, temperature: float,
                           conditions: str, alerts: Dict = None) -> None:
         """Cache weather data for a location"""
-        try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO weather_data (
-                        lat, lon, location, ts, precipitation_mm_h,
-                        wind_speed_kph, temperature_c, conditions, alerts
-                    )
-                    VALUES (
-                        %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326),
-                        CURRENT_TIMESTAMP, %s, %s, %s, %s, %s::jsonb
-                    )
-                """, (
-                    lat, lon, lon, lat, precipitation, wind_speed,
-                    temperature, conditions, psycopg2.extras.Json(alerts or {})
-                ))
-                
-                self.conn.commit()
-                
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO weather_data (
+                    lat, lon, location, ts, precipitation_mm_h,
+                    wind_speed_kph, temperature_c, conditions, alerts
+                )
+                VALUES (
+                    %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326),
+                    CURRENT_TIMESTAMP, %s, %s, %s, %s, %s::jsonb
+                )
+            """, (
+                lat, lon, lon, lat, precipitation, wind_speed,
+                temperature, conditions, psycopg2.extras.Json(alerts or {})
+            ))
     
     def get_weather_near(self, lat: float, lon: float, 
                         radius_km: float = 30) -> Optional[Dict]:
         """Get recent weather data near a location"""
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # The geography cast can't use the geometry index on location, so a
+        # degree-box (&&) around the point narrows candidates first
+        dlat = radius_km / KM_PER_DEG_LAT
+        dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+        with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
                 SELECT * FROM weather_data
-                WHERE ST_DWithin(
+                WHERE location && ST_Expand(ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s)
+                AND ST_DWithin(
                     location::geography,
                     ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography,
                     %s
@@ -376,23 +603,19 @@ class Database:
                 AND ts >= NOW() - INTERVAL '30 minutes'
                 ORDER BY ts DESC
                 LIMIT 1
-            """, (lon, lat, radius_km * 1000))  # Convert km to meters
+            """, (lon, lat, dlon, dlat, lon, lat, radius_km * 1000))  # Convert km to meters
             return cur.fetchone()
     
     # ==================== Vehicle Management ====================
     
     def get_vehicle(self, vehicle_id: int) -> Optional[Dict]:
         """Get vehicle details"""
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT * FROM vehicles WHERE id = %s
-            """, (vehicle_id,))
+        with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, 'get_vehicle', (vehicle_id,))
             return cur.fetchone()
     
     def get_vehicle_by_plate(self, plate: str) -> Optional[Dict]:
         """Get vehicle by plate number"""
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT * FROM vehicles WHERE plate = %s
-            """, (plate,))
+        with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, 'get_vehicle_by_plate', (plate,))
             return cur.fetchone()
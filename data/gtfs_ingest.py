@@ -8,12 +8,13 @@ This script downloads a GTFS static data zip file and loads it into the PostgreS
 import os
 import sys
 import csv
+import io
 import zipfile
 import requests
 from io import BytesIO
 from dotenv import load_dotenv
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2 import sql
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -44,133 +45,148 @@ def download_gtfs_zip(url):
     return BytesIO(response.content)
 
 
+class NonBlankLines:
+    """Read-only file wrapper that skips blank lines, which COPY csv rejects"""
+
+    def __init__(self, f):
+        self._lines = (line for line in f if line.strip())
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def copy_to_stage(cur, zip_file, filename, stage):
+    """
+    COPY a GTFS file verbatim into a temp table of TEXT columns
+
+    The table takes its columns from the file's own header, so feeds with
+    extra or reordered columns load unchanged; blank lines are skipped.
+    Returns the header.
+    """
+    with zip_file.open(filename) as raw:
+        f = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+        header = [name.strip() for name in next(csv.reader([f.readline()]))]
+        cur.execute(sql.SQL("CREATE TEMP TABLE {} ({}) ON COMMIT DROP").format(
+            sql.Identifier(stage),
+            sql.SQL(', ').join(sql.SQL("{} TEXT").format(sql.Identifier(name)) for name in header)
+        ))
+        cur.copy_expert(sql.SQL("COPY {} FROM STDIN WITH (FORMAT csv)").format(
+            sql.Identifier(stage)).as_string(cur), NonBlankLines(f))
+    return header
+
+
+def stage_column(header, name, cast='text', default="''"):
+    """
+    Select expression for one staged GTFS column
+
+    A default of None marks the column required; optional columns fall back
+    to default when absent from the file or empty.
+    """
+    column = sql.SQL("{}::{}").format(sql.Identifier(name), sql.SQL(cast))
+    if default is None:
+        if name not in header:
+            raise ValueError(f"required GTFS column {name!r} is missing")
+        return column
+    if name not in header:
+        return sql.SQL(default)
+    return sql.SQL("COALESCE({}, {})").format(column, sql.SQL(default))
+
+
+def load_staged(conn, zip_file, filename, table, key_columns, columns):
+    """
+    Bulk-load one GTFS file into table via COPY and a single upsert
+
+    columns maps target column -> (cast, default) as for stage_column;
+    key_columns form the ON CONFLICT target. A feed that repeats a key keeps
+    its last row, since one INSERT cannot touch the same row twice. Returns
+    the row count.
+    """
+    stage = 'stage_' + filename.split('.')[0]
+    with conn.cursor() as cur:
+        header = copy_to_stage(cur, zip_file, filename, stage)
+        cur.execute(sql.SQL("""
+            INSERT INTO {table} ({targets})
+            SELECT DISTINCT ON ({keys}) {targets}
+            -- ctid follows file order in the freshly COPYed stage table
+            FROM (SELECT {selects}, ctid AS row_pos FROM {stage}) AS staged
+            ORDER BY {keys}, row_pos DESC
+            ON CONFLICT ({keys}) DO UPDATE SET {updates}
+        """).format(
+            table=sql.SQL(table),
+            targets=sql.SQL(', ').join(map(sql.Identifier, columns)),
+            selects=sql.SQL(', ').join(
+                sql.SQL("{} AS {}").format(stage_column(header, name, cast, default), sql.Identifier(name))
+                for name, (cast, default) in columns.items()
+            ),
+            stage=sql.Identifier(stage),
+            keys=sql.SQL(', ').join(map(sql.Identifier, key_columns)),
+            updates=sql.SQL(', ').join(
+                sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(name))
+                for name in columns if name not in key_columns
+            ),
+        ))
+        count = cur.rowcount
+    conn.commit()
+    return count
+
+
 def ingest_routes(conn, zip_file):
     """Ingest routes.txt"""
     print("Ingesting routes...")
-    with zip_file.open('routes.txt') as f:
-        reader = csv.DictReader(f.read().decode('utf-8').splitlines())
-        rows = []
-        for row in reader:
-            rows.append((
-                row['route_id'],
-                row.get('route_short_name', ''),
-                row.get('route_long_name', ''),
-                int(row.get('route_type', 0))
-            ))
-        
-        with conn.cursor() as cur:
-            execute_batch(cur, """
-                INSERT INTO gtfs.routes (route_id, route_short_name, route_long_name, route_type)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (route_id) DO UPDATE SET
-                    route_short_name = EXCLUDED.route_short_name,
-                    route_long_name = EXCLUDED.route_long_name,
-                    route_type = EXCLUDED.route_type
-            """, rows)
-        
-        conn.commit()
-        print(f"Inserted {len(rows)} routes")
+    count = load_staged(conn, zip_file, 'routes.txt', 'gtfs.routes', ['route_id'], {
+        'route_id': ('text', None),
+        'route_short_name': ('text', "''"),
+        'route_long_name': ('text', "''"),
+        'route_type': ('int', '0'),
+    })
+    print(f"Inserted {count} routes")
 
 
 def ingest_stops(conn, zip_file):
     """Ingest stops.txt"""
     print("Ingesting stops...")
-    with zip_file.open('stops.txt') as f:
-        reader = csv.DictReader(f.read().decode('utf-8').splitlines())
-        rows = []
-        for row in reader:
-            rows.append((
-                row['stop_id'],
-                row.get('stop_name', ''),
-                float(row.get('stop_lat', 0)),
-                float(row.get('stop_lon', 0))
-            ))
-        
-        with conn.cursor() as cur:
-            execute_batch(cur, """
-                INSERT INTO gtfs.stops (stop_id, stop_name, stop_lat, stop_lon)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (stop_id) DO UPDATE SET
-                    stop_name = EXCLUDED.stop_name,
-                    stop_lat = EXCLUDED.stop_lat,
-                    stop_lon = EXCLUDED.stop_lon
-            """, rows)
-        
-        conn.commit()
-        print(f"Inserted {len(rows)} stops")
+    count = load_staged(conn, zip_file, 'stops.txt', 'gtfs.stops', ['stop_id'], {
+        'stop_id': ('text', None),
+        'stop_name': ('text', "''"),
+        'stop_lat': ('float8', '0'),
+        'stop_lon': ('float8', '0'),
+    })
+    print(f"Inserted {count} stops")
 
 
 def ingest_trips(conn, zip_file):
     """Ingest trips.txt"""
     print("Ingesting trips...")
-    with zip_file.open('trips.txt') as f:
-        reader = csv.DictReader(f.read().decode('utf-8').splitlines())
-        rows = []
-        for row in reader:
-            rows.append((
-                row['trip_id'],
-                row['route_id'],
-                row.get('trip_headsign', ''),
-                int(row.get('direction_id', 0))
-            ))
-        
-        with conn.cursor() as cur:
-            execute_batch(cur, """
-                INSERT INTO gtfs.trips (trip_id, route_id, trip_headsign, direction_id)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (trip_id) DO UPDATE SET
-                    route_id = EXCLUDED.route_id,
-                    trip_headsign = EXCLUDED.trip_headsign,
-                    direction_id = EXCLUDED.direction_id
-            """, rows, page_size=1000)
-        
-        conn.commit()
-        print(f"Inserted {len(rows)} trips")
+    count = load_staged(conn, zip_file, 'trips.txt', 'gtfs.trips', ['trip_id'], {
+        'trip_id': ('text', None),
+        'route_id': ('text', None),
+        'trip_headsign': ('text', "''"),
+        'direction_id': ('int', '0'),
+    })
+    print(f"Inserted {count} trips")
 
 
 def ingest_stop_times(conn, zip_file):
     """Ingest stop_times.txt"""
     print("Ingesting stop times...")
-    with zip_file.open('stop_times.txt') as f:
-        reader = csv.DictReader(f.read().decode('utf-8').splitlines())
-        rows = []
-        for row in reader:
-            rows.append((
-                row['trip_id'],
-                row['stop_id'],
-                int(row.get('stop_sequence', 0)),
-                row.get('arrival_time', ''),
-                row.get('departure_time', '')
-            ))
-            
-            # Process in batches to avoid memory issues
-            if len(rows) >= 10000:
-                with conn.cursor() as cur:
-                    execute_batch(cur, """
-                        INSERT INTO gtfs.stop_times (trip_id, stop_id, stop_sequence, arrival_time, departure_time)
-                        VALUES (%s, %s, %s, %s, %s)
-                        ON CONFLICT (trip_id, stop_sequence) DO UPDATE SET
-                            stop_id = EXCLUDED.stop_id,
-                            arrival_time = EXCLUDED.arrival_time,
-                            departure_time = EXCLUDED.departure_time
-                    """, rows, page_size=1000)
-                conn.commit()
-                print(f"Processed {len(rows)} stop times...")
-                rows = []
-        
-        # Process remaining rows
-        if rows:
-            with conn.cursor() as cur:
-                execute_batch(cur, """
-                    INSERT INTO gtfs.stop_times (trip_id, stop_id, stop_sequence, arrival_time, departure_time)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (trip_id, stop_sequence) DO UPDATE SET
-                        stop_id = EXCLUDED.stop_id,
-                        arrival_time = EXCLUDED.arrival_time,
-                        departure_time = EXCLUDED.departure_time
-                """, rows, page_size=1000)
-            conn.commit()
-            print(f"Processed final {len(rows)} stop times")
+    count = load_staged(conn, zip_file, 'stop_times.txt', 'gtfs.stop_times',
+                        ['trip_id', 'stop_sequence'], {
+        'trip_id': ('text', None),
+        'stop_id': ('text', None),
+        'stop_sequence': ('int', '0'),
+        'arrival_time': ('text', "''"),
+        'departure_time': ('text', "''"),
+    })
+    print(f"Inserted {count} stop times")
 
 
 def main():
@@ -73,7 +73,9 @@ CREATE TABLE IF NOT EXISTS positions (
 
 -- Create indexes on positions
 CREATE INDEX IF NOT EXISTS idx_positions_vehicle_ts ON positions(vehicle_id, ts DESC);
-CREATE INDEX IF NOT EXISTS idx_positions_location ON positions USING GIST(location);
+-- SP-GiST suits point-only columns: smaller and faster to probe than GiST
+DROP INDEX IF EXISTS idx_positions_location;
+CREATE INDEX IF NOT EXISTS idx_positions_location_spgist ON positions USING SPGIST(location);
 
 -- ETAs table (computed ETAs with delay reasons)
 CREATE TABLE IF NOT EXISTS etas (
@@ -156,7 +158,8 @@ CREATE TABLE IF NOT EXISTS weather_data (
 );
 
 -- Create spatial index on weather_data
-CREATE INDEX IF NOT EXISTS idx_weather_location_ts ON weather_data USING GIST(location);
+DROP INDEX IF EXISTS idx_weather_location_ts;
+CREATE INDEX IF NOT EXISTS idx_weather_location_spgist ON weather_data USING SPGIST(location);
 CREATE INDEX IF NOT EXISTS idx_weather_ts ON weather_data(ts DESC);
 
 -- Insert sample organization
@@ -14,6 +14,7 @@
 
 import React, { useState, useEffect, useCallback, useMemo, useRef } from 'react';
 import { io, Socket } from 'socket.io-client';
+import msgpackParser from 'socket.io-msgpack-parser';
 import { MapComponent } from '../components/Map';
 import { RerouteModal } from '../components/RerouteModal';
 import { CheckCircleIcon, TruckIcon, AlertTriangleIcon } from '../components/icons';
@@ -1511,7 +1512,7 @@ export const DashboardPage: React.FC = () => {
             return;
         }
 
-        const newSocket = io(API_URL);
+        const newSocket = io(API_URL, { parser: msgpackParser });
         setSocket(newSocket);
 
         newSocket.on('connect', () => {
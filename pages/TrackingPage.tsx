@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useMemo } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { io, Socket } from 'socket.io-client';
+import msgpackParser from 'socket.io-msgpack-parser';
 import { MapComponent } from '../components/Map';
 import { CheckCircleIcon, TruckIcon } from '../components/icons';
 import { Mode, Stop, TrafficSegment } from '../types';
@@ -282,7 +283,7 @@ export const TrackingPage: React.FC = () => {
             return;
         }
 
-        const newSocket = io(API_URL);
+        const newSocket = io(API_URL, { parser: msgpackParser });
         setSocket(newSocket);
 
         newSocket.on('connect', () => {
@@ -97,7 +97,7 @@ def test_ingest_positions(shipment_ref):
     result = response.json()
     print(json.dumps(result, indent=2))
     
-    return response.status_code == 200
+    return response.status_code in (200, 202)
 
 def test_get_shipment_status(shipment_id=1):
     """Test getting shipment status"""
@@ -148,7 +148,7 @@ class ETATrackerE2ETest:
             headers={"Content-Type": "application/json"}
         )
         
-        assert response.status_code == 200, f"Failed to ingest positions: {response.text}"
+        assert response.status_code in (200, 202), f"Failed to ingest positions: {response.text}"
         
         result = response.json()
         print(f"✓ Ingested {result['count']} GPS positions")
@@ -201,7 +201,7 @@ class ETATrackerE2ETest:
         print("="*60)
         
         # Initialize Socket.IO client
-        self.sio = socketio.Client()
+        self.sio = socketio.Client(serializer='msgpack')
         
         @self.sio.on('connect')
         def on_connect():
@@ -0,0 +1,210 @@
+"""
+Geo Kernel Tests
+Tests for the polyline codec and path simplification in backend/geo.py
+
+Run with: python test_geo.py
+"""
+import unittest
+import os
+import sys
+
+import numpy as np
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backend.geo import decode_polyline, encode_polyline, simplify_path, _rdp_keep
+
+
+def encode_reference(points, precision):
+    """Straightforward polyline encoder used as the decoder's reference"""
+    factor = 10 ** precision
+    chars = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        lat_i, lon_i = round(lat * factor), round(lon * factor)
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chars.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chars.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return ''.join(chars)
+
+
+class TestPolylineDecode(unittest.TestCase):
+    """Test decode_polyline against known and round-tripped polylines"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up test fixtures"""
+        # Beaumont, TX delivery stops, including a negative delta on both axes
+        cls.points = [
+            (30.08, -94.126),    # Beaumont DC
+            (30.063, -94.134),   # Target
+            (30.086, -94.101),   # Hospital
+            (30.053, -94.165)    # West End Plaza
+        ]
+
+    def test_known_polyline(self):
+        """Test the reference example from the polyline format spec"""
+        lats, lons = decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@', precision=5)
+
+        np.testing.assert_allclose(lats, [38.5, 40.7, 43.252])
+        np.testing.assert_allclose(lons, [-120.2, -120.95, -126.453])
+
+        print("✓ Reference polyline decodes")
+
+    def test_round_trip(self):
+        """Test encode -> decode round-trip at precision 5 and 6"""
+        for precision in (5, 6):
+            with self.subTest(precision=precision):
+                lats, lons = decode_polyline(encode_reference(self.points, precision), precision)
+
+                self.assertEqual(len(lats), len(self.points))
+                np.testing.assert_allclose(lats, [p[0] for p in self.points], atol=10 ** -precision)
+                np.testing.assert_allclose(lons, [p[1] for p in self.points], atol=10 ** -precision)
+
+        print("✓ Round-trip works at precision 5 and 6")
+
+    def test_truncated_polyline(self):
+        """Test that a cut-off string raises instead of reading past the end"""
+        encoded = encode_reference(self.points, 6)
+
+        # Cut inside a value, then right after a latitude (a zero longitude is one byte)
+        with self.assertRaises(ValueError):
+            decode_polyline(encoded[:-1])
+        with self.assertRaises(ValueError):
+            decode_polyline(encode_reference([(30.08, 0.0)], 6)[:-1])
+
+        print("✓ Truncated polylines raise ValueError")
+
+    def test_empty_polyline(self):
+        """Test that an empty string decodes to empty arrays"""
+        lats, lons = decode_polyline('')
+
+        self.assertEqual(lats.shape, (0,))
+        self.assertEqual(lons.shape, (0,))
+
+        print("✓ Empty polyline decodes to empty arrays")
+
+    def test_encode_polyline(self):
+        """Test encode_polyline against the reference encoder and the decoder"""
+        lats = [p[0] for p in self.points]
+        lons = [p[1] for p in self.points]
+        for precision in (5, 6):
+            with self.subTest(precision=precision):
+                encoded = encode_polyline(lats, lons, precision)
+
+                self.assertEqual(encoded, encode_reference(self.points, precision))
+                np.testing.assert_allclose(decode_polyline(encoded, precision)[0], lats, atol=10 ** -precision)
+
+        self.assertEqual(encode_polyline([], []), '')
+
+        print("✓ encode_polyline matches the reference encoder")
+
+
+class TestPathSimplify(unittest.TestCase):
+    """Test Ramer-Douglas-Peucker simplification (_rdp_keep / simplify_path)"""
+
+    def test_collinear_points(self):
+        """Test that collinear points collapse to the two endpoints"""
+        lats = np.linspace(30.0, 30.1, 50)
+        lons = np.full(50, -94.1)
+
+        out_lats, out_lons = simplify_path(lats, lons, 5.0)
+
+        np.testing.assert_array_equal(out_lats, [30.0, 30.1])
+        np.testing.assert_array_equal(out_lons, [-94.1, -94.1])
+
+        keep = _rdp_keep(np.arange(10.0), 2 * np.arange(10.0), 0.5)
+        self.assertEqual(np.flatnonzero(keep).tolist(), [0, 9])
+
+        print("✓ Collinear points collapse to the endpoints")
+
+    def test_spike_kept(self):
+        """Test that a deviation larger than the tolerance is kept and a smaller one dropped"""
+        x = np.arange(11.0)
+        y = np.zeros(11)
+        y[5] = 100.0
+
+        self.assertEqual(np.flatnonzero(_rdp_keep(x, y, 5.0)).tolist(), [0, 5, 10])
+
+        y[5] = 1.0
+        self.assertEqual(np.flatnonzero(_rdp_keep(x, y, 5.0)).tolist(), [0, 10])
+
+        # A ~1.1 km detour north of a straight east-west leg survives a 5 m tolerance
+        lats = np.array([30.0, 30.005, 30.01, 30.005, 30.0])
+        lons = np.array([-94.10, -94.11, -94.12, -94.13, -94.14])
+        out_lats, _ = simplify_path(lats, lons, 5.0)
+        np.testing.assert_array_equal(out_lats, [30.0, 30.01, 30.0])
+
+        print("✓ Spikes beyond the tolerance are kept")
+
+    def test_short_paths(self):
+        """Test that paths with fewer than 3 points come back unchanged"""
+        for n in range(3):
+            with self.subTest(points=n):
+                lats = np.linspace(30.0, 30.1, n)
+                lons = np.linspace(-94.1, -94.2, n)
+
+                out_lats, out_lons = simplify_path(lats, lons, 5.0)
+
+                np.testing.assert_array_equal(out_lats, lats)
+                np.testing.assert_array_equal(out_lons, lons)
+                self.assertTrue(_rdp_keep(lons, lats, 5.0).all())
+
+        print("✓ Paths with fewer than 3 points are unchanged")
+
+    def test_repeated_points(self):
+        """Test the zero-length segment branch with identical endpoints"""
+        lats = np.full(6, 30.08)
+        lons = np.full(6, -94.126)
+
+        out_lats, out_lons = simplify_path(lats, lons, 5.0)
+
+        self.assertEqual(len(out_lats), 2)
+        self.assertEqual(len(out_lons), 2)
+
+        # A loop back to the start keeps its far point, measured from the start
+        x = np.array([0.0, 0.0, 50.0, 0.0, 0.0])
+        y = np.array([0.0, 0.0, 0.0, 0.0, 0.0])
+        self.assertEqual(np.flatnonzero(_rdp_keep(x, y, 5.0)).tolist(), [0, 2, 4])
+
+        print("✓ Repeated identical points collapse without dividing by zero")
+
+
+def run_tests():
+    """Run all tests with detailed output"""
+    print("\n" + "=" * 70)
+    print("GEO KERNEL TESTS")
+    print("=" * 70)
+    print()
+
+    # Run tests
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+
+    # Add test classes
+    suite.addTests(loader.loadTestsFromTestCase(TestPolylineDecode))
+    suite.addTests(loader.loadTestsFromTestCase(TestPathSimplify))
+
+    # Run with verbose output
+    runner = unittest.TextTestRunner(verbosity=2)
+    result = runner.run(suite)
+
+    print("\n" + "=" * 70)
+    if result.wasSuccessful():
+        print("✓ ALL TESTS PASSED")
+    else:
+        print("✗ SOME TESTS FAILED")
+    print("=" * 70)
+    print()
+
+    return result.wasSuccessful()
+
+
+if __name__ == '__main__':
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -18,6 +18,10 @@ import math
 from datetime import datetime, timedelta
 from typing import List, Dict, Tuple
 
+import numpy as np
+
+from backend.http_client import make_session
+
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
@@ -31,6 +35,15 @@ SPEED_MPH_CITY = 30       # City speed (Urban areas)
 SPEED_KPH_HIGHWAY = SPEED_MPH_HIGHWAY * 1.60934  # Convert to km/h for calculations
 SPEED_KPH_CITY = SPEED_MPH_CITY * 1.60934        # Convert to km/h for calculations
 
+# GPS fixes per POST; --batch N buffers fixes like a telematics unit that uploads in bursts
+GPS_BATCH_SIZE = 1
+
+# One keep-alive connection to the backend, reused by every update and the health probe
+SESSION = make_session(pool_connections=1, pool_maxsize=4)
+
+# (point, log line) pairs waiting for the next batch POST
+_pending_points: List[Tuple[Dict, str]] = []
+
 # ============================================================================
 # ROUTE DEFINITIONS
 # ============================================================================
@@ -141,17 +154,21 @@ def calculate_distance_km(lat1: float, lon1: float, lat2: float, lon2: float) ->
     
     return R * c
 
-def calculate_heading(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate bearing/heading between two points (0-360 degrees)"""
-    dlon = math.radians(lon2 - lon1)
-    lat1_rad = math.radians(lat1)
+def calculate_heading(lat1, lon1, lat2: float, lon2: float):
+    """
+    Calculate bearing/heading between two points (0-360 degrees)
+    
+    lat1/lon1 may be NumPy arrays, giving one heading per point toward lat2/lon2
+    """
+    dlon = np.radians(lon2 - lon1)
+    lat1_rad = np.radians(lat1)
     lat2_rad = math.radians(lat2)
     
-    x = math.sin(dlon) * math.cos(lat2_rad)
-    y = (math.cos(lat1_rad) * math.sin(lat2_rad) - 
-         math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(dlon))
+    x = np.sin(dlon) * math.cos(lat2_rad)
+    y = (np.cos(lat1_rad) * math.sin(lat2_rad) - 
+         np.sin(lat1_rad) * math.cos(lat2_rad) * np.cos(dlon))
     
-    bearing = math.degrees(math.atan2(x, y))
+    bearing = np.degrees(np.arctan2(x, y))
     return (bearing + 360) % 360
 
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -171,39 +188,60 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     
     return R * c
 
-def interpolate_points(start: Dict, end: Dict, num_points: int = 10) -> List[Dict]:
-    """Create intermediate GPS points between two waypoints for smooth movement"""
-    points = []
-    for i in range(num_points):
-        t = i / (num_points - 1) if num_points > 1 else 0
-        lat = start["lat"] + t * (end["lat"] - start["lat"])
-        lon = start["lon"] + t * (end["lon"] - start["lon"])
-        points.append({"lat": lat, "lon": lon})
-    return points
+def interpolate_points(start: Dict, end: Dict, num_points: int = 10) -> List[Tuple[float, float, float]]:
+    """
+    Create intermediate GPS points between two waypoints for smooth movement
+    
+    Returns (lat, lon, heading toward end) per point, computed for the whole
+    segment at once so the send loop only iterates.
+    """
+    lats = np.linspace(start["lat"], end["lat"], num_points)
+    lons = np.linspace(start["lon"], end["lon"], num_points)
+    headings = calculate_heading(lats, lons, end["lat"], end["lon"])
+    return list(zip(lats.tolist(), lons.tolist(), headings.tolist()))
 
 def send_gps_update(tracking_number: str, vehicle_id: int, lat: float, lon: float, 
                     speed_mph: float, heading: float) -> bool:
-    """Send GPS position update to backend API"""
+    """
+    Queue a GPS fix for the backend, stamped now
+    
+    The buffer is POSTed once it holds GPS_BATCH_SIZE fixes (every fix by
+    default); returns False if that POST failed.
+    """
+    # Convert MPH to KPH for database storage (international standard)
+    speed_kph = speed_mph * 1.60934
+    
+    _pending_points.append(({
+        "ts": datetime.utcnow().isoformat() + "Z",
+        "lat": lat,
+        "lon": lon,
+        "speed_kph": speed_kph,
+        "heading_deg": heading
+    }, f"📍 GPS: {lat:.6f}, {lon:.6f} | Speed: {speed_mph:.1f} mph | Heading: {heading:.0f}°"))
+    
+    if len(_pending_points) < GPS_BATCH_SIZE:
+        return True
+    return flush_gps_updates(vehicle_id)
+
+def flush_gps_updates(vehicle_id: int) -> bool:
+    """Send all queued GPS fixes to the backend API in one request"""
+    if not _pending_points:
+        return True
+    batch = _pending_points[:]
+    _pending_points.clear()
+    
     try:
-        # Convert MPH to KPH for database storage (international standard)
-        speed_kph = speed_mph * 1.60934
-        
         data = {
             "vehicle_id": vehicle_id,
-            "points": [{
-                "ts": datetime.utcnow().isoformat() + "Z",
-                "lat": lat,
-                "lon": lon,
-                "speed_kph": speed_kph,
-                "heading_deg": heading
-            }]
+            "points": [point for point, _ in batch]
         }
         
-        response = requests.post(f"{API_URL}/v1/positions", json=data, timeout=5)
+        response = SESSION.post(f"{API_URL}/v1/positions", json=data, timeout=5)
         
-        if response.status_code == 200:
+        if response.status_code in (200, 202):
             timestamp = datetime.now().strftime("%H:%M:%S")
-            print(f"  [{timestamp}] 📍 GPS: {lat:.6f}, {lon:.6f} | Speed: {speed_mph:.1f} mph | Heading: {heading:.0f}°")
+            for _, line in batch:
+                print(f"  [{timestamp}] {line}")
             return True
         else:
             print(f"  ❌ API Error: {response.status_code} - {response.text[:100]}")
@@ -222,7 +260,7 @@ def send_gps_update(tracking_number: str, vehicle_id: int, lat: float, lon: floa
 def check_backend_connection() -> bool:
     """Verify backend API is accessible"""
     try:
-        response = requests.get(f"{API_URL}/health", timeout=3)
+        response = SESSION.get(f"{API_URL}/health", timeout=3)
         return response.status_code == 200
     except:
         return False
@@ -268,11 +306,9 @@ def simulate_long_haul(tracking_number: str, vehicle_id: int) -> bool:
         # Create smooth movement between waypoints
         interpolated = interpolate_points(current, next_point, num_points=num_pings)
         
-        for point in interpolated:
-            heading = calculate_heading(point["lat"], point["lon"], next_point["lat"], next_point["lon"])
-            
+        for lat, lon, heading in interpolated:
             if not send_gps_update(tracking_number, vehicle_id, 
-                                  point["lat"], point["lon"], 
+                                  lat, lon, 
                                   segment_speed_mph, heading):
                 print("⚠️ Failed to send GPS update, continuing...")
             
@@ -290,6 +326,7 @@ def simulate_long_haul(tracking_number: str, vehicle_id: int) -> bool:
                               0.0, heading)  # Speed = 0 when stopped
                 time.sleep(10)  # Compressed time
     
+    flush_gps_updates(vehicle_id)
     print("\n✅ Long-haul phase complete! Arrived at Beaumont Distribution Center")
     return True
 
@@ -331,12 +368,9 @@ def simulate_last_mile(tracking_number: str, vehicle_id: int, route_id: str) ->
         num_points = max(8, int(distance * 10))  # More points for city driving
         interpolated = interpolate_points(current, next_stop, num_points=num_points)
         
-        for point in interpolated:
-            heading = calculate_heading(point["lat"], point["lon"], 
-                                       next_stop["lat"], next_stop["lon"])
-            
+        for lat, lon, heading in interpolated:
             if not send_gps_update(tracking_number, vehicle_id, 
-                                  point["lat"], point["lon"], 
+                                  lat, lon, 
                                   SPEED_KPH_CITY, heading):
                 print("⚠️ Failed to send GPS update, continuing...")
             
@@ -348,6 +382,7 @@ def simulate_last_mile(tracking_number: str, vehicle_id: int, route_id: str) ->
             print(f"  (Simulated: {next_stop['dwell_min'] // 3} seconds)")
             time.sleep(next_stop['dwell_min'] / 3)  # Compress time for demo
     
+    flush_gps_updates(vehicle_id)
     print("\n✅ Last-mile deliveries complete! All packages delivered")
     return True
 
@@ -366,6 +401,7 @@ def run_simulation(tracking_number: str, vehicle_id: int,
     print(f"Tracking Number: {tracking_number}")
     print(f"Vehicle ID: {vehicle_id}")
     print(f"GPS Update Interval: {GPS_UPDATE_INTERVAL} seconds")
+    print(f"GPS Fixes per Upload: {GPS_BATCH_SIZE}")
     print(f"Backend API: {API_URL}")
     print("=" * 80)
     
@@ -420,6 +456,7 @@ def print_usage():
     print("  --vehicle <id>        Vehicle ID (default: 1)")
     print("  --skip-longhaul       Skip long-haul, start from Beaumont")
     print("  --route <route_id>    Last-mile route ID")
+    print("  --batch <n>           GPS fixes per upload (default: 1)")
     print("\nAvailable Last-Mile Routes:")
     for route_id, route in LAST_MILE_ROUTES.items():
         print(f"  {route_id:20} - {route['name']}")
@@ -456,6 +493,9 @@ if __name__ == "__main__":
         elif arg == "--route":
             last_mile_route = args[i + 1]
             i += 2
+        elif arg == "--batch":
+            GPS_BATCH_SIZE = max(1, int(args[i + 1]))
+            i += 2
         elif not arg.startswith("--"):
             tracking_number = arg
             i += 1